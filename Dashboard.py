@@ -145,6 +145,51 @@ fig = plot_states(level=level_selection)
 st.plotly_chart(fig, use_container_width=True)
 
 
+st.markdown('## Ähnlichkeit der Lehrpläne')
+
+st.markdown('''
+Die folgende Darstellung zeigt die paarweisen Distanzen zwischen allen Lehrplänen, entweder zwischen ihren
+Themenverteilungen oder zwischen den mittleren Embeddings ihrer Phrasen.
+Die Lehrpläne sind hierarchisch geclustert, sodass ähnliche Lehrpläne nebeneinander stehen.
+''')
+
+metric_selection = st.selectbox(
+    key='select_metric',
+    label='Distanzmaß',
+    options=list(similarity.METRICS),
+    format_func=similarity.METRICS.get
+)
+
+fig = plot_curriculum_similarity(metric=metric_selection)
+
+st.plotly_chart(fig, use_container_width=True)
+
+
+st.markdown('## Gemeinsames Auftreten der Themen')
+
+st.markdown('''
+Die folgende Darstellung zeigt für jedes Paar von Themen, wie viel häufiger sie gemeinsam in einem Abschnitt
+eines Lehrplans vorkommen, als bei unabhängigem Auftreten zu erwarten wäre (Lift).
+Werte über 0 (log2) bedeuten, dass die Themen häufig zusammen behandelt werden, Werte unter 0, dass sie eher getrennt
+behandelt werden.
+''')
+
+cols = st.columns(2)
+
+with cols[0]:
+    cooccurrence_state = st.selectbox(key='cooccurrence_state', label='Bundesland', options=['Alle'] + get_states())
+
+with cols[1]:
+    cooccurrence_level = st.selectbox(key='cooccurrence_level', label='Stufe', options=['Alle'] + get_level())
+
+fig = plot_cooccurrence(
+    state=None if cooccurrence_state == 'Alle' else cooccurrence_state,
+    level=None if cooccurrence_level == 'Alle' else cooccurrence_level
+)
+
+st.plotly_chart(fig, use_container_width=True)
+
+
 st.markdown('## Architektur und Relevanz')
 
 fig = plot_duality()
@@ -162,13 +207,14 @@ threshold = st.slider(label='Grenzwert', value=0.8, min_value=0.5, max_value=1.0
 
 filter_check = st.checkbox(label='Nach Bundesland und Stufe filtern')
 
-details = get_topic(selection, threshold)
+filter_state = None
+filter_level = None
 
 if filter_check:
     filter_state = st.selectbox(key='filter_state', label='Bundesland', options=get_states())
     filter_level = st.selectbox(key='filter_level', label='Stufe', options=get_level())
 
-    details = details[(details['Bundesland'] == filter_state) & (details['Stufe'] == filter_level)]
+details = get_topic(selection, threshold, state=filter_state, level=filter_level)
 
 
 st.dataframe(details)
@@ -186,27 +232,70 @@ selection_state = st.selectbox(label='Bundesland', options=get_states())
 
 selection_level = st.selectbox(label='Stufe', options=get_level())
 
-curriculum = get_curriculum(state=selection_state, level=selection_level)
-
-grouped = curriculum.groupby('titel')
+curriculum = get_curriculum_text(state=selection_state, level=selection_level)
 
 with st.expander(label='Lehrplan'):
 
-    for name, group in grouped:
+    for name, s in curriculum:
         st.subheader(name, divider=True)
 
-        s = '  \n'.join(group['raw_sentence'])
-
         st.markdown(s)
 
 
+st.markdown('## Übereinstimmende Formulierungen')
+
+st.markdown('''
+Viele Lehrpläne übernehmen Formulierungen voneinander oder aus den Bildungsstandards.
+Die folgende Tabelle zeigt Gruppen nahezu gleicher Phrasen, die in mindestens zwei Lehrplänen vorkommen,
+sortiert nach der Anzahl der Lehrpläne.
+''')
+
+duplicate_clusters = get_duplicate_clusters()
+
+st.dataframe(duplicate_clusters, use_container_width=True)
+
+if len(duplicate_clusters):
+    cluster_selection = st.selectbox(
+        key='select_cluster',
+        label='Gruppe',
+        options=duplicate_clusters.index,
+        format_func=lambda cluster: f'{cluster}: {duplicate_clusters.loc[cluster, "Phrase"]}'
+    )
+
+    st.dataframe(get_duplicate_cluster(cluster_selection), use_container_width=True)
+
+st.download_button(
+    label='Herunterladen',
+    data=get_duplicates_csv(),
+    file_name='duplicates.csv',
+    mime='text/csv'
+)
+
+
 st.markdown('## Semantische Suche')
 
-search_term = st.text_input(label='Suchphrase', value='Künstliche Intelligenz')
+# Without a default query, opening the dashboard does not load the topic model to embed one
+search_term = st.text_input(label='Suchphrase', placeholder='z. B. Künstliche Intelligenz')
+
+if search_term:
+    result = search_for(search_term=search_term)
+
+    st.dataframe(result)
+
+    st.markdown('Phrasen aus den Lehrplänen, die der Suchphrase am ähnlichsten sind:')
 
-result = search_for(search_term=search_term)
+    search_filter = st.checkbox(key='search_filter', label='Nach Bundesland und Stufe filtern')
 
-st.dataframe(result)
+    search_state = None
+    search_level = None
+
+    if search_filter:
+        search_state = st.selectbox(key='search_state', label='Bundesland', options=get_states())
+        search_level = st.selectbox(key='search_level', label='Stufe', options=get_level())
+
+    phrases = search_sentences(search_term=search_term, state=search_state, level=search_level)
+
+    st.dataframe(phrases)
 
 
 st.markdown('## Kernaussagen')
@@ -339,4 +428,9 @@ st.markdown('''
 
 Unter diesem [Link](https://umfrage-ddi.cs.uni-paderborn.de/index.php/365976?lang=de)
 haben Sie die Möglichkeit Fragen, Kommentaren, Vorschlägen, Feedback oder Kritik zu äußern.
-''')
\ No newline at end of file
+''')
+
+if 'stats' in st.experimental_get_query_params():
+    st.markdown('## Cache')
+
+    st.dataframe(cache_stats(), use_container_width=True)
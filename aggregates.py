@@ -0,0 +1,117 @@
+import os
+
+import pandas as pd
+
+import artifacts
+import store
+
+OTHER_LABEL = 'Sonstiges'
+
+GROUPS = ['bundesland', 'stufe']
+
+
+def topic_props(df, model, rows=slice(None)):
+    """
+    :param rows:
+    slice of the sentences to return, all by default
+    :return:
+    Topic probabilities of each sentence next to its bundesland and stufe.
+    The probability of belonging to none of the topics is listed as OTHER_LABEL.
+    """
+    labels = model.get_topic_info()['CustomName'].tolist()[1:]
+    probabilities = model.probabilities_[rows]
+
+    # Columns are inserted instead of concatenated, so the frame keeps pointing at the
+    # (memory-mapped or shared) probability matrix instead of consolidating it into a copy.
+    df_props = pd.DataFrame(probabilities, columns=labels, copy=False)
+    df_props.insert(len(labels), OTHER_LABEL, 1 - probabilities.sum(axis=1))
+
+    for i, group in enumerate(GROUPS):
+        df_props.insert(i, group, df[group].values[rows])
+
+    return df_props
+
+
+class TopicCube:
+    """
+    Topic probabilities aggregated per curriculum (bundesland × stufe).
+
+    Sums and counts are kept instead of means, so the cube can be combined with new sentences
+    without touching the existing ones.
+    """
+
+    def __init__(self, sums, counts):
+        self.sums = sums
+        self.counts = counts
+
+    @classmethod
+    def from_props(cls, df_props):
+        grouped = df_props.groupby(GROUPS, observed=True)
+        return cls(grouped.sum(), grouped.size())
+
+    @classmethod
+    def from_frame(cls, df):
+        df = df.set_index(GROUPS)
+        return cls(df.drop('count', axis=1), df['count'])
+
+    def to_frame(self):
+        df = self.sums.copy()
+        df.insert(0, 'count', self.counts)
+        return df.reset_index()
+
+    def combine(self, other):
+        """
+        :return:
+        Cube of the sentences of both cubes
+        """
+        df = pd.concat([self.to_frame(), other.to_frame()], ignore_index=True)
+
+        for group in GROUPS:
+            df[group] = df[group].astype(str)
+
+        return TopicCube.from_frame(df.groupby(GROUPS, sort=True).sum().reset_index())
+
+    @property
+    def mean(self):
+        return self.sums.div(self.counts, axis=0)
+
+    @property
+    def topics(self):
+        return self.sums.columns
+
+    @property
+    def curricula(self):
+        """
+        :return:
+        (bundesland, stufe) of the rows of the cube
+        """
+        return [(str(state), str(level)) for state, level in self.sums.index]
+
+
+def cube_name(version):
+    return f'cube-{version}'
+
+
+def load_cube(df_props, version, data_dir=store.DATA_DIR):
+    """
+    Loads the cube for the given data/model version and builds it from df_props if it does not exist yet.
+    """
+    name = cube_name(version)
+
+    if os.path.exists(store.table_path(name, data_dir)):
+        return TopicCube.from_frame(store.load_table(name, data_dir=data_dir))
+
+    cube = TopicCube.from_props(df_props)
+    store.write_table(cube.to_frame(), name, data_dir)
+
+    return cube
+
+
+def build_cube(data_dir=store.DATA_DIR, model_dir=artifacts.MODEL_DIR):
+    documents, df, duality = store.load_store(data_dir)
+    model = artifacts.load_artifacts(model_dir)
+
+    cube = TopicCube.from_props(topic_props(df, model))
+    store.write_table(cube.to_frame(), cube_name(store.version(data_dir, model_dir)), data_dir)
+
+    return cube
@@ -1,10 +1,24 @@
 import numpy as np
 import pandas as pd
-from bertopic import BERTopic
-import os
 import plotly.graph_objects as go
+import threading
 from plotly.subplots import make_subplots
-import streamlit as st
+
+import aggregates
+import cache
+import artifacts
+import bootstrap
+import cooccurrence
+import duplicates
+import embedding_cache
+import figures
+import hierarchy
+import projection
+import search
+import similarity
+import sentence_embeddings
+import store
+import topic_index
 
 OTHER_LABEL = 'Sonstiges'
 
@@ -51,39 +65,76 @@ color_sek1 = 'rgb(180, 120, 20)'
 color_sek2 = 'rgb(20, 120, 180)'
 
 
-@st.cache_resource
+@cache.cached(maxsize=1, copy=False)
 def load_data():
-    documents = pd.read_json(os.path.join('data', 'documents.json'))
-    sentences = pd.read_json(os.path.join('data', 'sentences.json'))
+    documents, df, duality = store.load_store()
+
+    sentences = df[['document', 'i', 'sentence', 'raw_sentence']]
 
     docs = sentences['sentence']
 
-    topic_model = BERTopic.load(os.path.join('model', 'topic_model_merged.pkl'))
+    model = artifacts.load_artifacts()
+
+    return documents, sentences, docs, model, df, duality
+
+
+documents, sentences, docs, model, df, duality = load_data()
 
-    df = sentences.merge(documents, left_on='document', right_index=True, how='left')
+# Derived results and figures are stored for the version of the loaded data, not the one on disk when they are used
+version = store.version()
 
-    duality = pd.read_json(os.path.join('data', 'duality.json'))
 
-    return documents, sentences, docs, topic_model, df, duality
+_topic_model = None
 
+# Sessions that miss the model at the same time must not each unpickle it
+_topic_model_lock = threading.Lock()
+
+
+def get_topic_model():
+    """
+    The full BERTopic model is only loaded the first time a view needs to embed text.
+    """
+    global _topic_model
+
+    if _topic_model is None:
+        with _topic_model_lock:
+            if _topic_model is None:
+                _topic_model = artifacts.load_topic_model()
+
+    return _topic_model
+
+
+@cache.cached(maxsize=1, copy=False)
+def get_embedding_cache():
+    return embedding_cache.EmbeddingCache(embedding_cache.cache_path(artifacts.model_fingerprint()))
+
+
+def embed(texts):
+    """
+    Embeds texts with the embedding model of the topic model. Embeddings are cached on disk,
+    so the full model is only loaded for texts that have never been embedded before.
+    """
+    def compute(missing):
+        return get_topic_model()._extract_embeddings(missing, method='word', verbose=False)
 
-documents, sentences, docs, topic_model, df, duality = load_data()
+    return get_embedding_cache().embed(texts, compute)
 
-@st.cache_data
+
+@cache.cached(maxsize=1)
 def get_states():
-    return sorted(df['bundesland'].unique())
+    return list(df['bundesland'].cat.categories)
 
-@st.cache_data
+@cache.cached(maxsize=1)
 def get_level():
-    return sorted(df['stufe'].unique())
+    return list(df['stufe'].cat.categories)
 
-@st.cache_resource
+@cache.cached(maxsize=1)
 def get_df_topics():
     """
     :return:
     DataFrame for downloading
     """
-    df_topics = topic_model.get_topic_info().set_index('Topic')[['CustomName', 'Count', 'Representation']]
+    df_topics = model.get_topic_info().set_index('Topic')[['CustomName', 'Count', 'Representation']]
 
     df_topics.index.name = None
 
@@ -105,44 +156,94 @@ def get_df_topics():
 
 df_topics = get_df_topics()
 
+# All sessions serialize this table; pandas builds the lookup of an index lazily, which is not safe in several threads
+df_topics.index.is_unique
+
 
-@st.cache_resource
+@cache.cached(maxsize=1, copy=False)
 def get_df_props():
-    probabilities = topic_model.probabilities_
-    labels = topic_model.get_topic_info()['CustomName'].tolist()[1:]
-    df_props = pd.DataFrame(probabilities, columns=labels)
-    df_props[OTHER_LABEL] = 1 - df_props.sum(axis=1)
+    return aggregates.topic_props(df, model)
 
-    df_props = pd.concat([df[['bundesland', 'stufe']], df_props], axis=1)
 
-    return df_props
+df_props = get_df_props()
 
 
-df_props = get_df_props()
+@cache.cached(maxsize=1, copy=False)
+def get_cube():
+    """
+    :return:
+    Topic probabilities aggregated per curriculum, shared by all figures
+    """
+    return aggregates.load_cube(df_props, version)
+
 
+cube = get_cube()
 
-@st.cache_resource
+
+@cache.cached(maxsize=1, copy=False)
+def get_topic_index():
+    props = df_props.drop(['bundesland', 'stufe'], axis=1)
+    return topic_index.load_topic_index(props, version)
+
+
+props_index = get_topic_index()
+
+
+@cache.cached(maxsize=1, copy=False)
+def get_bootstrap():
+    return bootstrap.load_bootstrap(model.probabilities_, cube, curricula, version, processes=store.SESSION_PROCESSES)
+
+
+@cache.cached(maxsize=64, copy=False)
+def get_share_replicates(level=None, states=None):
+    """
+    :param states:
+    tuple of states, all by default
+    :return:
+    Bootstrap replicates of the mean topic shares of the curricula of the level and states (replicates × topics)
+    """
+    b = get_bootstrap()
+    return b.means(b.rows(level, states))
+
+
+def share_intervals(level=None, states=None):
+    """
+    :return:
+    DataFrame with the lower and upper bound of the confidence interval of the mean topic shares in percent
+    """
+    lower, upper = bootstrap.Bootstrap.interval(get_share_replicates(level, states)) * 100
+    return pd.DataFrame({'lower': lower, 'upper': upper}, index=get_bootstrap().topics)
+
+
+@cache.cached(maxsize=1)
+@figures.stored()
 def get_total_topic_dist():
 
-    # Calculate mean for each curriculum
-    prop = df_props.groupby(['bundesland', 'stufe']).mean()
+    # Mean for each curriculum
+    prop = cube.mean
+
+    intervals = share_intervals().loc[prop.columns]
 
     fig = go.Figure(
         data=[
             go.Pie(
                 labels=prop.columns,
                 values=prop.mean(),
-                hole=0.3
+                hole=0.3,
+                customdata=intervals.to_numpy(),
+                hovertemplate='%{label}<br>%{percent}<br>95%-KI: %{customdata[0]:.2f} – %{customdata[1]:.2f} %'
+                              '<extra></extra>'
             )
         ],
     )
 
     return fig
 
-@st.cache_resource
+@cache.cached(maxsize=1)
+@figures.stored()
 def get_topic_dist_for_level():
 
-    prop = df_props.groupby(['bundesland', 'stufe']).mean()
+    prop = cube.mean
 
     fig = make_subplots(
         rows=1,
@@ -186,34 +287,33 @@ def get_topic_dist_for_level():
 
 
 
-@st.cache_data
+@cache.cached(maxsize=1)
 def n_states():
     return len(documents['bundesland'].unique())
 
 
-@st.cache_data
+@cache.cached(maxsize=1)
 def n_curricula():
-    return len(documents.groupby(['bundesland', 'stufe']))
+    return len(documents.groupby(['bundesland', 'stufe'], observed=True))
 
 
-@st.cache_data
+@cache.cached(maxsize=1)
 def n_sentences():
     return len(sentences)
 
-@st.cache_resource
+@cache.cached(maxsize=1)
 def sentences_per_curriculum(self):
-    lengths = self.df.groupby(['bundesland', 'stufe']).apply(lambda g: len(g)).unstack(level=1)
+    lengths = self.df.groupby(['bundesland', 'stufe'], observed=True).apply(lambda g: len(g)).unstack(level=1)
 
-@st.cache_resource
+@cache.cached(maxsize=1)
+@figures.stored()
 def plot_level():
 
-    props = df_props.copy()
+    df_curricula = cube.mean.reset_index()
 
-    props = props[props['bundesland'].isin(COMPLETE_STATES)]
+    df_curricula = df_curricula[df_curricula['bundesland'].isin(COMPLETE_STATES)]
 
-    df_curricula = props.groupby(['bundesland', 'stufe'], as_index=False).mean()
-
-    df_level = df_curricula.drop('bundesland', axis=1).groupby('stufe').mean().T
+    df_level = df_curricula.drop('bundesland', axis=1).groupby('stufe', observed=True).mean().T
 
     df_level = df_level*100
 
@@ -221,10 +321,30 @@ def plot_level():
 
     df_level = df_level.sort_values('diff')
 
+    # Bootstrap confidence intervals of the shares and of their difference
+    states = tuple(COMPLETE_STATES)
+    intervals = {
+        level: share_intervals(level, states).loc[df_level.index]
+        for level in ['Sekundarstufe I', 'Sekundarstufe II']
+    }
+
+    diff = get_share_replicates('Sekundarstufe I', states) - get_share_replicates('Sekundarstufe II', states)
+    lower, upper = bootstrap.Bootstrap.interval(diff) * 100
+    intervals['diff'] = pd.DataFrame({'lower': lower, 'upper': upper}, index=get_bootstrap().topics).loc[df_level.index]
+
+    def error_x(column):
+        return dict(
+            type='data',
+            symmetric=False,
+            array=intervals[column]['upper'] - df_level[column],
+            arrayminus=df_level[column] - intervals[column]['lower']
+        )
+
     diff_trace = go.Bar(
                 name='Differenz',
                 y=df_level.index,
                 x=df_level['diff'],
+                error_x=error_x('diff'),
                 orientation='h'
             )
 
@@ -234,12 +354,14 @@ def plot_level():
                 name='Sekundarstufe II',
                 y=df_level.index,
                 x=df_level['Sekundarstufe II'],
+                error_x=error_x('Sekundarstufe II'),
                 orientation='h'
             ),
             go.Bar(
                 name='Sekundarstufe I',
                 y=df_level.index,
                 x=df_level['Sekundarstufe I'],
+                error_x=error_x('Sekundarstufe I'),
                 orientation='h'
             ),
             diff_trace
@@ -283,18 +405,15 @@ def plot_level():
 
     return fig
 
-@st.cache_resource
+@cache.cached(maxsize=1)
+@figures.stored()
 def plot_level_barpolar():
 
-    props = df_props.copy()
-
-    props = props[props['bundesland'].isin(COMPLETE_STATES)]
+    df_curricula = cube.mean.drop(OTHER_LABEL, axis=1).reset_index()
 
-    props = props.drop(OTHER_LABEL, axis=1)
+    df_curricula = df_curricula[df_curricula['bundesland'].isin(COMPLETE_STATES)]
 
-    df_curricula = props.groupby(['bundesland', 'stufe'], as_index=False).mean()
-
-    df_level = df_curricula.drop('bundesland', axis=1).groupby('stufe').mean().T
+    df_level = df_curricula.drop('bundesland', axis=1).groupby('stufe', observed=True).mean().T
     order = df_level.mean(axis=1).sort_values(ascending=False).index
 
     df_level = df_level.loc[order]
@@ -329,11 +448,10 @@ def plot_level_barpolar():
 
     return fig
 
-@st.cache_resource
+@cache.cached(maxsize=3)
+@figures.stored(grid=[{'level': level} for level in ['Sekundarstufe I', 'Sekundarstufe II', 'Sekundarstufe I & II']])
 def plot_states(level=None):
-    props = df_props.copy()
-
-    props = (props.groupby(['bundesland', 'stufe']).mean() * 100).drop(OTHER_LABEL, axis=1)
+    props = (cube.mean * 100).drop(OTHER_LABEL, axis=1)
 
     if level in ['Sekundarstufe I', 'Sekundarstufe II']:
         #df = props[props['stufe'] == level].drop('bunde')
@@ -344,11 +462,18 @@ def plot_states(level=None):
 
         df = df[df['bundesland'].isin(COMPLETE_STATES)]
 
-        df = df.drop('stufe', axis=1).groupby('bundesland').mean()
+        df = df.drop('stufe', axis=1).groupby('bundesland', observed=True).mean()
 
 
         #df = props[props['bundesland'].isin(COMPLETE_STATES)].groupby('bundesland').mean()
 
+    # Bootstrap confidence interval of every cell, shown on hover
+    intervals = [
+        share_intervals(level if level != 'Sekundarstufe I & II' else None, (state,)).loc[df.columns]
+        for state in df.index
+    ]
+    customdata = np.stack([[i[bound].to_numpy() for i in intervals] for bound in ['lower', 'upper']], axis=-1)
+
     fig = go.Figure(
         go.Heatmap(
             z=df,
@@ -357,6 +482,9 @@ def plot_states(level=None):
             text=df.round(1),
             texttemplate="%{text}",
             textfont={"size": 12},
+            customdata=customdata,
+            hovertemplate='%{y}<br>%{x}<br>%{z:.1f} % (95%-KI: %{customdata[0]:.1f} – %{customdata[1]:.1f})'
+                          '<extra></extra>'
         )
     )
 
@@ -369,9 +497,59 @@ def plot_states(level=None):
 
     return fig
 
-@st.cache_resource
+@cache.cached(maxsize=3)
+@figures.stored(grid=[{'metric': metric} for metric in similarity.METRICS])
+def plot_curriculum_similarity(metric='cosine'):
+    """
+    Clustered heatmap of the distances between all curricula, see similarity.METRICS
+    """
+    names = cube.curricula
+
+    def compute():
+        if metric == 'centroid':
+            ranges = [curricula.ranges[name] for name in names]
+            return similarity.centroid_distances(get_sentence_index().embeddings, ranges)
+
+        return similarity.topic_distances(cube, metric)
+
+    fig = similarity.plot_distances(similarity.load_distances(metric, version, compute), names)
+
+    fig.update_layout(
+        height=800,
+        xaxis=dict(
+            tickangle=60
+        )
+    )
+
+    return fig
+
+@cache.cached(maxsize=1, copy=False)
+def get_cooccurrence():
+    return cooccurrence.load_cooccurrence(df, model, version)
+
+@cache.cached(maxsize=32)
+@figures.stored(grid=[{'level': None}, {'level': 'Sekundarstufe I'}, {'level': 'Sekundarstufe II'}])
+def plot_cooccurrence(state=None, level=None):
+    """
+    Heatmap of the lift of the topic pairs within the sections of the curricula of the state and level (all by
+    default)
+    """
+    c = get_cooccurrence()
+    fig = cooccurrence.plot_lift(c.lift(state, level), c.matrix(state, level)[0])
+
+    fig.update_layout(
+        height=800,
+        xaxis=dict(
+            tickangle=60
+        )
+    )
+
+    return fig
+
+@cache.cached(maxsize=1)
+@figures.stored()
 def plot_topic_similarity():
-    fig = topic_model.visualize_hierarchy(custom_labels=True)
+    fig = hierarchy.plot_hierarchy(hierarchy.load_hierarchy())
 
     fig.update_layout(
         template="plotly_dark",
@@ -383,9 +561,18 @@ def plot_topic_similarity():
 
     return fig
 
-@st.cache_resource
+@cache.cached(maxsize=1)
 def plot_sentences():
-    fig = topic_model.visualize_documents(docs, custom_labels=True, hide_annotations=True)
+    def compute():
+        return projection.compute_projection(get_sentence_index().embeddings)
+
+    xy = projection.load_projection(version, compute)
+
+    topic_info = model.get_topic_info()
+    names = dict(zip(topic_info['Topic'], topic_info['CustomName']))
+    names.pop(-1, None)
+
+    fig = projection.plot_projection(xy, model.topics_, names, df['raw_sentence'])
 
     fig.update_layout(
         template="plotly",
@@ -400,14 +587,19 @@ def plot_sentences():
 
     return fig
 
-@st.cache_resource
-def get_topic(topic_name, threshold=0.8):
+def get_topic(topic_name, threshold=0.8, state=None, level=None):
+
+    filters = []
+
+    if state is not None:
+        filters.append((df['bundesland'].array.codes, df['bundesland'].cat.categories.get_loc(state)))
 
-    topic = df_topics[df_topics['Thema'] == topic_name].index[0]
+    if level is not None:
+        filters.append((df['stufe'].array.codes, df['stufe'].cat.categories.get_loc(level)))
 
-    props = df_props
+    ids = props_index.query(topic_name, threshold, filters)
 
-    docs = df[props[topic_name] > threshold]
+    docs = df.iloc[ids]
 
     docs = docs[['raw_sentence', 'bundesland', 'stufe', 'titel']]
 
@@ -422,12 +614,12 @@ def get_topic(topic_name, threshold=0.8):
 
     return docs
 
-@st.cache_resource
+@cache.cached(maxsize=256, ttl=3600)
 def search_for(search_term, threshold=0.5):
 
-    search_term = search_term.lower()
+    search_embedding = embed([search_term])[0]
 
-    topics, props = topic_model.find_topics(search_term=search_term)
+    topics, props = model.find_topics(search_embedding)
 
 
     s = pd.Series(props, index=topics)
@@ -442,19 +634,113 @@ def search_for(search_term, threshold=0.5):
 
     return result
 
-@st.cache_resource
+@cache.cached(maxsize=1, copy=False)
+def get_sentence_index():
+    def compute():
+        return sentence_embeddings.embed_sentences(
+            docs.tolist(), version, get_topic_model(), processes=store.SESSION_PROCESSES
+        )
+
+    return search.load_sentence_index(version, compute)
+
+
+def search_sentences(search_term, k=20, state=None, level=None):
+    """
+    :return:
+    The k sentences most similar to the search term, optionally restricted to a state and/or level
+    """
+    query = embed([search_term])[0]
+
+    ids, scores = get_sentence_index().search(query, k, ranges=curricula.select(state, level))
+
+    result = df.iloc[ids][['raw_sentence', 'bundesland', 'stufe', 'titel']]
+
+    result = result.rename({
+        'raw_sentence': 'Phrase',
+        'bundesland': 'Bundesland',
+        'stufe': 'Stufe',
+        'titel': 'Abschnitt'
+    }, axis=1)
+
+    result['Ähnlichkeit'] = scores
+
+    return result.reset_index(drop=True)
+
+@cache.cached(maxsize=1, copy=False)
+def get_curricula():
+    return store.load_curricula()
+
+
+curricula = get_curricula()
+
+
+def cache_stats():
+    """
+    :return:
+    Statistics of the caches of this process, including the embedding cache
+    """
+    stats = cache.stats()
+
+    embeddings = get_embedding_cache().stats()
+    stats.loc[len(stats)] = {
+        'name': 'embedding_cache',
+        'entries': embeddings['size'],
+        'maxsize': embeddings['maxsize'],
+        'hits': embeddings['hits'],
+        'misses': embeddings['misses']
+    }
+
+    return stats
+
+
 def get_curriculum(state, level):
-    curriculum = df[(df['bundesland'] == state) & (df['stufe'] == level)]
-    return curriculum
+    return df.iloc[curricula.rows(state, level)]
+
+
+def get_curriculum_text(state, level):
+    """
+    :return:
+    List of (titel, markdown) of the sections of the curriculum
+    """
+    return curricula.text(state, level)
+
+
+@cache.cached(maxsize=1, copy=False)
+def get_duplicates():
+    return duplicates.load_duplicates(df, version, processes=store.SESSION_PROCESSES)
+
+
+@cache.cached(maxsize=1)
+def get_duplicate_clusters():
+    """
+    :return:
+    One row per cluster of near-duplicate phrases, see duplicates.summarize
+    """
+    return duplicates.summarize(get_duplicates())
+
+
+def get_duplicate_cluster(cluster):
+    d = get_duplicates()
+    return d[d['cluster'] == cluster].drop('cluster', axis=1)
+
+
+@cache.cached(maxsize=1, copy=False)
+def get_duplicates_csv():
+    """
+    :return:
+    The clusters as UTF-8 encoded CSV, for the download of the dashboard
+    """
+    return get_duplicates().to_csv(index=False).encode('utf-8')
 
-@st.cache_resource
+@cache.cached(maxsize=1)
+@figures.stored()
 def plot_duality():
     d = duality.copy()
-    d = d.groupby(topic_model.topics_).mean()
+    d = d.groupby(model.topics_).mean()
 
     d = d.drop(-1)
 
-    topics = topic_model.get_topic_info().set_index('Topic')
+    topics = model.get_topic_info().set_index('Topic')
 
     d.index = map(lambda topic: topics.loc[topic]['CustomName'], d.index)
 
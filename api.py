@@ -0,0 +1,268 @@
+"""
+HTTP API over the analysis engine (CurriculaAnalysis), for tools that need the data without the dashboard.
+
+    python api.py [--port 8000] [--processes 1] [--threads 8]
+
+Tables are returned as JSON records, or as an Arrow IPC stream if the request sends
+"Accept: application/vnd.apache.arrow.stream" or ?format=arrow.
+
+    GET /topics                                  topic table
+    GET /topics/<topic>/sentences?threshold=0.8&state=&level=
+    GET /curricula                               bundesland, stufe and row range of every curriculum
+    GET /curricula/<state>/<level>               sections of a curriculum (titel, markdown)
+    GET /aggregates                              mean topic probabilities per curriculum
+    GET /search/topics?q=&threshold=0.5
+    GET /search/sentences?q=&k=20&state=&level=
+    GET /duplicates?cluster=                     near-duplicate phrases of all clusters or one cluster
+    GET /stats                                   statistics of the caches and the embedding cache
+
+All work runs in a thread pool, so the event loop keeps accepting requests while embeddings or
+searches are computed. With --processes, several processes serve the same port; start them with
+CURRICULA_SHM (see shared.py) so they share the data.
+"""
+import argparse
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pyarrow as pa
+import tornado.httpserver
+import tornado.netutil
+import tornado.process
+import tornado.web
+
+from util import CurriculaAnalysis
+
+ARROW_TYPE = 'application/vnd.apache.arrow.stream'
+
+
+def to_arrow(df):
+    table = pa.Table.from_pandas(df, preserve_index=False)
+
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+
+    return sink.getvalue().to_pybytes()
+
+
+class Handler(tornado.web.RequestHandler):
+
+    def initialize(self, analysis, executor):
+        self.analysis = analysis
+        self.executor = executor
+
+    async def run(self, func, *args):
+        """
+        Runs func in the thread pool of the API.
+        """
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    def optional_argument(self, name):
+        value = self.get_argument(name, None)
+        return value if value else None
+
+    def number_argument(self, name, default, type=float):
+        value = self.get_argument(name, None)
+
+        if value is None:
+            return default
+
+        try:
+            return type(value)
+        except ValueError:
+            raise tornado.web.HTTPError(400, f'{name} must be a number')
+
+    def wants_arrow(self):
+        return self.get_argument('format', None) == 'arrow' or ARROW_TYPE in self.request.headers.get('Accept', '')
+
+    def write_frame(self, df):
+        if self.wants_arrow():
+            self.set_header('Content-Type', ARROW_TYPE)
+            self.write(to_arrow(df))
+        else:
+            self.write_json(df.to_json(orient='records', force_ascii=False))
+
+    def write_json(self, data):
+        if not isinstance(data, str):
+            data = json.dumps(data, ensure_ascii=False)
+
+        self.set_header('Content-Type', 'application/json; charset=utf-8')
+        self.write(data)
+
+    def check_curriculum(self, state, level):
+        if state is not None and state not in self.analysis.states:
+            raise tornado.web.HTTPError(404, f'Unknown state {state}')
+
+        if level is not None and level not in self.analysis.level:
+            raise tornado.web.HTTPError(404, f'Unknown level {level}')
+
+
+class TopicsHandler(Handler):
+
+    async def get(self):
+        df_topics = await self.run(lambda: self.analysis.df_topics)
+        self.write_frame(df_topics.rename_axis('Topic').reset_index())
+
+
+class TopicSentencesHandler(Handler):
+
+    async def get(self, topic):
+        threshold = self.number_argument('threshold', 0.8)
+        state = self.optional_argument('state')
+        level = self.optional_argument('level')
+
+        self.check_curriculum(state, level)
+
+        if topic not in self.analysis.cube.topics:
+            raise tornado.web.HTTPError(404, f'Unknown topic {topic}')
+
+        self.write_frame(await self.run(self.analysis.get_topic, topic, threshold, state, level))
+
+
+class CurriculaHandler(Handler):
+
+    def get(self):
+        self.write_json([
+            {'bundesland': state, 'stufe': level, 'start': start, 'stop': stop}
+            for (state, level), (start, stop) in self.analysis.curricula.ranges.items()
+        ])
+
+
+class CurriculumHandler(Handler):
+
+    def get(self, state, level):
+        self.check_curriculum(state, level)
+
+        sections = self.analysis.get_curriculum_text(state, level)
+
+        if not sections:
+            raise tornado.web.HTTPError(404, f'No curriculum for {state}, {level}')
+
+        self.write_frame(pd.DataFrame(sections, columns=['titel', 'markdown']))
+
+
+class AggregatesHandler(Handler):
+
+    def get(self):
+        cube = self.analysis.cube
+
+        df = cube.mean
+        df.insert(0, 'count', cube.counts)
+
+        self.write_frame(df.reset_index())
+
+
+class SearchTopicsHandler(Handler):
+
+    async def get(self):
+        q = self.get_argument('q')
+        threshold = self.number_argument('threshold', 0.5)
+
+        result = await self.run(self.analysis.search_term, q, threshold)
+
+        if result is None:
+            result = self.analysis.df_topics.iloc[:0]
+
+        self.write_frame(result.rename_axis('Topic').reset_index())
+
+
+class SearchSentencesHandler(Handler):
+
+    async def get(self):
+        q = self.get_argument('q')
+        k = self.number_argument('k', 20, int)
+        state = self.optional_argument('state')
+        level = self.optional_argument('level')
+
+        self.check_curriculum(state, level)
+
+        if not 0 < k <= 1000:
+            raise tornado.web.HTTPError(400, 'k must be between 1 and 1000')
+
+        self.write_frame(await self.run(self.analysis.search_sentences, q, k, state, level))
+
+
+class DuplicatesHandler(Handler):
+
+    async def get(self):
+        cluster = self.number_argument('cluster', None, int)
+
+        if cluster is None:
+            result = await self.run(lambda: self.analysis.duplicates)
+        else:
+            result = await self.run(self.analysis.get_duplicate_cluster, cluster)
+
+        self.write_frame(result)
+
+
+class StatsHandler(Handler):
+
+    def get(self):
+        self.write_frame(self.analysis.cache_stats())
+
+
+def make_app(analysis, executor):
+    kwargs = dict(analysis=analysis, executor=executor)
+
+    return tornado.web.Application([
+        (r'/topics', TopicsHandler, kwargs),
+        (r'/topics/([^/]+)/sentences', TopicSentencesHandler, kwargs),
+        (r'/curricula', CurriculaHandler, kwargs),
+        (r'/curricula/([^/]+)/([^/]+)', CurriculumHandler, kwargs),
+        (r'/aggregates', AggregatesHandler, kwargs),
+        (r'/search/topics', SearchTopicsHandler, kwargs),
+        (r'/search/sentences', SearchSentencesHandler, kwargs),
+        (r'/duplicates', DuplicatesHandler, kwargs),
+        (r'/stats', StatsHandler, kwargs),
+    ])
+
+
+def load_analysis():
+    """
+    Loads the analysis and everything the handlers use, before the server accepts requests. Otherwise the first
+    requests, arriving concurrently on the threads of the pool, would each compute the same missing data. Only the
+    topic model and sentence index, which the search needs, are loaded by the first search.
+    """
+    analysis = CurriculaAnalysis()
+
+    analysis.cube
+    analysis.topic_index
+    analysis.curricula
+    analysis.states
+    analysis.level
+    analysis.df_topics
+    analysis.duplicates
+
+    return analysis
+
+
+async def serve(sockets, threads):
+    analysis = load_analysis()
+    executor = ThreadPoolExecutor(threads, thread_name_prefix='api')
+
+    server = tornado.httpserver.HTTPServer(make_app(analysis, executor))
+    server.add_sockets(sockets)
+
+    await asyncio.Event().wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--processes', type=int, default=1, help='Number of processes, 0 for one per CPU')
+    parser.add_argument('--threads', type=int, default=8, help='Worker threads per process')
+    args = parser.parse_args()
+
+    sockets = tornado.netutil.bind_sockets(args.port, args.host)
+
+    if args.processes != 1:
+        tornado.process.fork_processes(args.processes)
+
+    asyncio.run(serve(sockets, args.threads))
+
+
+if __name__ == '__main__':
+    main()
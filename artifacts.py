@@ -0,0 +1,167 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.feather as feather
+
+import shared
+
+MODEL_DIR = os.environ.get('CURRICULA_MODEL', 'model')
+
+MODEL_FILE = 'topic_model_merged.pkl'
+
+# Bumped whenever the exported files change, so outdated bundles are exported again
+ARTIFACTS_FORMAT = 2
+
+
+def model_path(model_dir=MODEL_DIR):
+    return os.path.join(model_dir, MODEL_FILE)
+
+
+def artifacts_dir(model_dir=MODEL_DIR):
+    return os.path.join(model_dir, 'artifacts')
+
+
+def artifact_path(name, model_dir=MODEL_DIR):
+    return os.path.join(artifacts_dir(model_dir), name)
+
+
+def model_fingerprint(model_dir=MODEL_DIR):
+    """
+    Identifies the saved topic model by size and modification time, which is much cheaper than hashing it.
+    """
+    stat = os.stat(model_path(model_dir))
+    return hashlib.sha256(json.dumps([MODEL_FILE, stat.st_size, stat.st_mtime_ns]).encode()).hexdigest()[:16]
+
+
+def load_topic_model(model_dir=MODEL_DIR):
+    """
+    Unpickles the full BERTopic model (including the embedding model). This is expensive and
+    only necessary for operations that embed new text.
+    """
+    from bertopic import BERTopic
+
+    return BERTopic.load(model_path(model_dir))
+
+
+def export_artifacts(topic_model=None, model_dir=MODEL_DIR):
+    """
+    Exports the parts of the topic model the views are built from into model/artifacts.
+    """
+    if topic_model is None:
+        topic_model = load_topic_model(model_dir)
+
+    return write_artifacts(
+        topic_model.probabilities_,
+        topic_model.topics_,
+        topic_model.get_topic_info(),
+        # Rows of topic_embeddings_ belong to the sorted topic ids (see BERTopic.find_topics)
+        sorted(topic_model.topic_representations_.keys()),
+        topic_model.topic_embeddings_,
+        model_dir
+    )
+
+
+def _save(array, name, model_dir):
+    # Written next to the target and renamed, so processes that memory-map the old file keep a valid mapping
+    path = artifact_path(name, model_dir)
+    with open(path + '.tmp', 'wb') as f:
+        np.save(f, array)
+    os.replace(path + '.tmp', path)
+
+
+def write_artifacts(probabilities, topics, topic_info, topic_ids, topic_embeddings, model_dir=MODEL_DIR):
+    """
+    Writes the artifacts for the given topic probabilities and assignments of the sentences.
+    """
+    os.makedirs(artifacts_dir(model_dir), exist_ok=True)
+
+    probabilities = np.ascontiguousarray(probabilities, dtype=np.float64)
+    topics = np.asarray(topics, dtype=np.int64)
+
+    _save(probabilities, 'probabilities.npy', model_dir)
+    _save(topics, 'topics.npy', model_dir)
+    _save(np.asarray(topic_ids, dtype=np.int64), 'topic_ids.npy', model_dir)
+    _save(np.asarray(topic_embeddings, dtype=np.float32), 'topic_embeddings.npy', model_dir)
+
+    path = artifact_path('topic_info.arrow', model_dir)
+    table = pa.Table.from_pandas(topic_info, preserve_index=False)
+    feather.write_feather(table, path + '.tmp', compression='uncompressed')
+    os.replace(path + '.tmp', path)
+
+    h = hashlib.sha256()
+    h.update(probabilities.tobytes())
+    h.update(topics.tobytes())
+    h.update(topic_info.to_json().encode())
+
+    manifest = {
+        'format': ARTIFACTS_FORMAT,
+        'version': h.hexdigest()[:16],
+        'n_sentences': len(topics),
+        'n_topics': probabilities.shape[1]
+    }
+
+    with open(artifact_path('manifest.json', model_dir), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    return manifest
+
+
+def ensure_artifacts(model_dir=MODEL_DIR):
+    path = artifact_path('manifest.json', model_dir)
+
+    if not os.path.exists(path) or read_manifest(model_dir).get('format') != ARTIFACTS_FORMAT:
+        export_artifacts(model_dir=model_dir)
+
+
+def read_manifest(model_dir=MODEL_DIR):
+    with open(artifact_path('manifest.json', model_dir)) as f:
+        return json.load(f)
+
+
+class ModelArtifacts:
+    """
+    Read-only stand-in for the attributes of the BERTopic model that the views use.
+    The arrays are memory-mapped or read from shared memory.
+    """
+
+    def __init__(self, model_dir=MODEL_DIR):
+        self.model_dir = model_dir
+        self.version = read_manifest(model_dir)['version']
+
+        self.probabilities_ = shared.read_npy(artifact_path('probabilities.npy', model_dir))
+        self.topics_ = shared.read_npy(artifact_path('topics.npy', model_dir))
+
+        self.topic_ids = shared.read_npy(artifact_path('topic_ids.npy', model_dir))
+        self.topic_embeddings_ = shared.read_npy(artifact_path('topic_embeddings.npy', model_dir))
+
+        table = shared.read_arrow(artifact_path('topic_info.arrow', model_dir))
+        self.topic_info = table.to_pandas()
+
+        for field in table.schema:
+            if pa.types.is_list(field.type):
+                self.topic_info[field.name] = self.topic_info[field.name].map(list)
+
+    def get_topic_info(self):
+        return self.topic_info.copy()
+
+    def find_topics(self, search_embedding, top_n=5):
+        """
+        Same as BERTopic.find_topics, but for an already embedded search term.
+        """
+        topic_embeddings = np.asarray(self.topic_embeddings_)
+        search_embedding = np.asarray(search_embedding, dtype=np.float32).ravel()
+
+        norms = np.linalg.norm(topic_embeddings, axis=1) * np.linalg.norm(search_embedding)
+        sims = topic_embeddings @ search_embedding / np.where(norms == 0, 1, norms)
+
+        ids = np.argsort(sims)[-top_n:][::-1]
+
+        return self.topic_ids[ids].tolist(), sims[ids].tolist()
+
+
+def load_artifacts(model_dir=MODEL_DIR):
+    ensure_artifacts(model_dir)
+    return ModelArtifacts(model_dir)
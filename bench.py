@@ -0,0 +1,497 @@
+"""
+Benchmarks the analysis functions on synthetic corpora of growing size.
+
+    python bench.py run [--scales 1 10 100 1000] [--functions ...] [--repeat 5] [--output bench.json]
+    python bench.py compare old.json new.json
+
+For every scale, a corpus with the schema of data/*.json (scale × 400 sections over the 16 states and
+both levels) and a stand-in model bundle (random topic probabilities and embeddings) is generated
+into --workdir and reused by later runs, so neither the data nor the BERTopic model is needed.
+
+Every function runs in a fresh process on a store without derived files (cube, indexes, figures,
+embedding cache): once cold and --repeat times warm. The results contain the timings and the peak
+memory of the process and can be compared between commits with `compare`.
+
+A corpus is generated in chunks of CHUNK_DOCUMENTS documents, so generating it needs little more memory than the
+topic probabilities of the stand-in model (about 0.5 GB at 100x, 1.1 GB of them at 1000x). build_store reads the
+JSON sources as a whole and needs about 1.1 GB at 100x and about 11 GB at 1000x.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+import artifacts
+import store
+
+SCALES = [1, 10, 100, 1000]
+
+STATES = [
+    'Baden-Württemberg', 'Bayern', 'Berlin', 'Brandenburg', 'Bremen', 'Hamburg', 'Hessen',
+    'Mecklenburg-Vorpommern', 'Niedersachsen', 'Nordrhein-Westfalen', 'Rheinland-Pfalz', 'Saarland',
+    'Sachsen', 'Sachsen-Anhalt', 'Schleswig Holstein', 'Thüringen'
+]
+
+LEVELS = ['Sekundarstufe I', 'Sekundarstufe II']
+
+# Size of the real corpus (scale 1)
+N_DOCUMENTS = 400
+SENTENCES_PER_DOCUMENT = 17.3
+WORDS_PER_SENTENCE = 11
+
+N_TOPICS = 20
+DIMENSIONS = 64
+
+# Sections generated at a time
+CHUNK_DOCUMENTS = 10_000
+
+TOPIC = 'Algorithmen und Datenstrukturen'
+SEARCH_TERM = 'Algorithmen und Datenstrukturen'
+
+FUNCTIONS = {
+    'df_props': lambda a: a.df_props,
+    'cube': lambda a: a.cube,
+    'get_total_topic_dist': lambda a: a.get_total_topic_dist(),
+    'get_topic_dist_for_level': lambda a: a.get_topic_dist_for_level(),
+    'plot_level': lambda a: a.plot_level(),
+    'plot_level_barpolar': lambda a: a.plot_level_barpolar(),
+    'plot_states': lambda a: a.plot_states(LEVELS[0]),
+    'plot_duality': lambda a: a.plot_duality(),
+    'plot_curriculum_similarity': lambda a: a.plot_curriculum_similarity('jensenshannon'),
+    'plot_cooccurrence': lambda a: a.plot_cooccurrence(level=LEVELS[0]),
+    'duplicates': lambda a: a.duplicates,
+    'get_topic': lambda a: a.get_topic(TOPIC, 0.5),
+    'get_topic_filtered': lambda a: a.get_topic(TOPIC, 0.5, STATES[1], LEVELS[0]),
+    'get_curriculum': lambda a: a.get_curriculum(STATES[1], LEVELS[0]),
+    'get_curriculum_text': lambda a: a.get_curriculum_text(STATES[1], LEVELS[0]),
+    'search_term': lambda a: a.search_term(SEARCH_TERM),
+    'search_sentences': lambda a: a.search_sentences(SEARCH_TERM),
+}
+
+
+class StandInModel:
+    """
+    Replaces the BERTopic model: random topic probabilities and embeddings of the right shapes.
+    """
+
+    def __init__(self, n_sentences=0, seed=0, dimensions=DIMENSIONS):
+        rng = np.random.default_rng(seed)
+        self.dimensions = dimensions
+
+        # Drawn in chunks, which gives the same values as one draw without its temporary arrays
+        probabilities = np.empty((n_sentences, N_TOPICS))
+        for start in range(0, n_sentences, 1 << 16):
+            stop = min(start + (1 << 16), n_sentences)
+            probabilities[start:stop] = rng.dirichlet(np.full(N_TOPICS + 1, 0.3), size=stop - start)[:, :N_TOPICS]
+
+        self.probabilities_ = probabilities
+        self.topics_ = np.where(probabilities.max(axis=1) > 0.3, probabilities.argmax(axis=1), -1)
+
+        self.topic_representations_ = {topic: [] for topic in range(-1, N_TOPICS)}
+        self.topic_embeddings_ = rng.normal(size=(N_TOPICS + 1, dimensions))
+
+    def get_topic_info(self):
+        from util import custom_names
+
+        topics = list(range(-1, N_TOPICS))
+        counts = pd.Series(self.topics_).value_counts()
+
+        return pd.DataFrame({
+            'Topic': topics,
+            'Count': [int(counts.get(topic, 0)) for topic in topics],
+            'Name': [f'{topic}_topic' for topic in topics],
+            'CustomName': ['-1_outliers'] + [custom_names[topic] for topic in topics[1:]],
+            'Representation': [[] for _ in topics],
+            'Representative_Docs': [[] for _ in topics]
+        })
+
+    def _extract_embeddings(self, docs, method='document', verbose=False):
+        docs = list(docs)
+        seed = zlib.crc32('\n'.join(docs[:100]).encode()) + len(docs)
+        return np.random.default_rng(seed).normal(size=(len(docs), self.dimensions)).astype(np.float32)
+
+
+def vocabulary(rng, size=5000):
+    syllables = ['in', 'for', 'ma', 'tik', 'da', 'ten', 'al', 'go', 'rith', 'men', 'sys', 'tem', 'mo', 'dell',
+                 'netz', 'werk', 'pro', 'gramm', 'ler', 'nen', 'schü', 'be', 'schrei', 'ben', 'ana', 'ly', 'se']
+
+    lengths = rng.integers(2, 5, size=size)
+    return sorted({''.join(rng.choice(syllables, n)) for n in lengths})
+
+
+class ColumnsWriter:
+    """
+    Writes a table chunk by chunk as JSON in the layout of DataFrame.to_json (an object per column, keyed by the
+    row), so it is never held in memory as a whole. The layout puts all values of a column together, so every
+    column goes to a temporary file first and the files are joined when the writer is closed.
+    """
+
+    def __init__(self, path, columns):
+        self.path = path
+        self.columns = columns
+        self.files = {column: tempfile.TemporaryFile('w+', encoding='utf-8') for column in columns}
+        self.rows = 0
+
+    def write(self, chunk):
+        """
+        :param chunk:
+        Dictionary of equally long numpy or Arrow arrays per column
+        """
+        n = len(chunk[self.columns[0]])
+        if not n:
+            return
+
+        keys = [str(row) for row in range(self.rows, self.rows + n)]
+
+        for column in self.columns:
+            values = chunk[column]
+            values = values.to_pylist() if isinstance(values, pa.Array) else values.tolist()
+
+            if self.rows:
+                self.files[column].write(',')
+            self.files[column].write(json.dumps(dict(zip(keys, values)))[1:-1])
+
+        self.rows += n
+
+    def close(self):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write('{')
+
+            for i, column in enumerate(self.columns):
+                f.write((',' if i else '') + json.dumps(column) + ':{')
+
+                self.files[column].seek(0)
+                shutil.copyfileobj(self.files[column], f)
+                self.files[column].close()
+
+                f.write('}')
+
+            f.write('}')
+
+
+def join_words(words, lengths):
+    """
+    :return:
+    Arrow array of the words joined by spaces, lengths[i] words for the i-th string
+    """
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int32)
+    return pc.binary_join(pa.ListArray.from_arrays(offsets, words), ' ')
+
+
+def generate_corpus(scale, data_dir, model_dir, seed=0, chunk_documents=CHUNK_DOCUMENTS):
+    """
+    Writes documents.json, sentences.json and duality.json of a synthetic corpus with scale × the size of
+    the real one, and exports a stand-in model bundle for it.
+
+    The columns are generated as arrays, chunk_documents sections at a time, and streamed to the files, so the
+    memory does not grow with the scale.
+    """
+    rng = np.random.default_rng(seed)
+    words = pa.array(vocabulary(rng))
+
+    n_documents = N_DOCUMENTS * scale
+    curricula = [(state, level) for state in STATES for level in LEVELS]
+
+    # Sections are ordered by curriculum, as in the real corpus
+    document_curricula = np.sort(rng.integers(len(curricula), size=n_documents))
+    n_sentences = rng.poisson(SENTENCES_PER_DOCUMENT - 1, size=n_documents) + 1
+
+    states = np.array([state for state, level in curricula], dtype=object)
+    levels = np.array([level for state, level in curricula], dtype=object)
+
+    os.makedirs(data_dir, exist_ok=True)
+
+    # Without the annotated tokens (doc), which only the pipeline reads and which would dominate the memory
+    writers = {
+        'documents': ColumnsWriter(store.source_path('documents', data_dir), ['bundesland', 'stufe', 'titel', 'text']),
+        'sentences': ColumnsWriter(store.source_path('sentences', data_dir), ['document', 'i', 'sentence',
+                                                                              'raw_sentence']),
+        'duality': ColumnsWriter(store.source_path('duality', data_dir), ['architecture', 'relevance', 'connection'])
+    }
+
+    for start in range(0, n_documents, chunk_documents):
+        stop = min(start + chunk_documents, n_documents)
+        counts = n_sentences[start:stop]
+        n = int(counts.sum())
+
+        lengths = rng.poisson(WORDS_PER_SENTENCE - 1, size=n) + 1
+        sentence = join_words(words.take(rng.integers(len(words), size=int(lengths.sum()))), lengths)
+        raw_sentence = pc.binary_join_element_wise(pc.utf8_capitalize(sentence), '.', '')
+
+        title_lengths = rng.integers(2, 6, size=stop - start)
+        titel = pc.utf8_capitalize(
+            join_words(words.take(rng.integers(len(words), size=int(title_lengths.sum()))), title_lengths)
+        )
+
+        first = np.repeat(np.cumsum(counts) - counts, counts)
+
+        writers['sentences'].write({
+            'document': np.repeat(np.arange(start, stop), counts),
+            'i': np.arange(n) - first,
+            'sentence': sentence,
+            'raw_sentence': raw_sentence,
+        })
+
+        writers['documents'].write({
+            'bundesland': states[document_curricula[start:stop]],
+            'stufe': levels[document_curricula[start:stop]],
+            'titel': titel,
+            'text': pc.binary_join_element_wise(titel, join_words(raw_sentence, counts), '\n'),
+        })
+
+        scores = rng.random((n, 3))
+        writers['duality'].write({
+            'architecture': scores[:, 0],
+            'relevance': scores[:, 1],
+            'connection': scores[:, 2],
+        })
+
+    for writer in writers.values():
+        writer.close()
+
+    artifacts.export_artifacts(StandInModel(int(n_sentences.sum()), seed), model_dir)
+
+    # The workers replace the topic model with a StandInModel; the file only gives the model a fingerprint
+    with open(artifacts.model_path(model_dir), 'w') as f:
+        f.write('stand-in')
+
+
+def corpus_dirs(workdir, scale):
+    root = os.path.join(workdir, f'corpus-{scale}x')
+    return os.path.join(root, 'data'), os.path.join(root, 'model')
+
+
+def clear_derived(data_dir):
+    """
+    Removes everything that is computed from the store, so the next process starts cold.
+    """
+    keep = {store.table_path(name, data_dir) for name in store.SOURCES + ['curricula']}
+    keep.add(store.manifest_path(data_dir))
+
+    names = os.listdir(store.store_dir(data_dir)) if os.path.isdir(store.store_dir(data_dir)) else []
+
+    for name in names:
+        path = os.path.join(store.store_dir(data_dir), name)
+        if path not in keep:
+            os.remove(path)
+
+    for name in ['figures', 'cache']:
+        shutil.rmtree(os.path.join(data_dir, name), ignore_errors=True)
+
+
+def reset_peak_rss():
+    """
+    Resets the peak memory of the process, which it otherwise inherits across exec from its parent (Linux only).
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def peak_rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / (1 << 10)
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def run_function(name, repeat):
+    """
+    Runs in the worker process: loads the analysis of the corpus set in CURRICULA_DATA/CURRICULA_MODEL
+    and times one function.
+    """
+    import util
+
+    reset_peak_rss()
+
+    if name == 'build_store':
+        return {'function': name, 'cold_s': timed(store.build_store), 'peak_rss_mb': peak_rss_mb()}
+
+    start = time.perf_counter()
+    analysis = util.CurriculaAnalysis()
+    analysis._topic_model = StandInModel()
+    load = time.perf_counter() - start
+    load_rss = peak_rss_mb()
+
+    func = FUNCTIONS[name]
+
+    cold = timed(func, analysis)
+    warm = [timed(func, analysis) for _ in range(repeat)]
+
+    return {
+        'function': name,
+        'load_s': load,
+        'cold_s': cold,
+        'warm_s': warm,
+        'warm_median_s': statistics.median(warm) if warm else None,
+        'load_rss_mb': load_rss,
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+
+def run_worker(name, repeat, data_dir, model_dir):
+    clear_derived(data_dir)
+
+    env = dict(os.environ, CURRICULA_DATA=data_dir, CURRICULA_MODEL=model_dir)
+    env.pop('CURRICULA_SHM', None)
+
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), 'worker', name, '--repeat', str(repeat)],
+        env=env,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        check=True,
+        capture_output=True,
+        text=True
+    ).stdout
+
+    return json.loads(output.splitlines()[-1])
+
+
+def commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            check=True,
+            capture_output=True,
+            text=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(scales, functions, repeat, workdir, regenerate=False):
+    results = []
+
+    for scale in scales:
+        data_dir, model_dir = corpus_dirs(workdir, scale)
+
+        if regenerate or not os.path.exists(artifacts.model_path(model_dir)):
+            print(f'{scale}x: generating corpus ...', file=sys.stderr)
+            generate_corpus(scale, data_dir, model_dir)
+
+        print(f'{scale}x: build_store ...', file=sys.stderr)
+        build = run_worker('build_store', 0, data_dir, model_dir)
+        manifest = store.read_manifest(data_dir)
+
+        corpus = {
+            'scale': scale,
+            'n_documents': manifest['n_documents'],
+            'n_sentences': manifest['n_sentences']
+        }
+
+        results.append(dict(corpus, **build))
+
+        for name in functions:
+            print(f'{scale}x: {name} ...', file=sys.stderr)
+            results.append(dict(corpus, **run_worker(name, repeat, data_dir, model_dir)))
+
+    return {
+        'commit': commit(),
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repeat': repeat,
+        'results': results
+    }
+
+
+def compare(old, new):
+    """
+    :return:
+    DataFrame with the timings of both runs and their ratio (new / old) per scale and function
+    """
+    columns = ['scale', 'function', 'cold_s', 'warm_median_s', 'peak_rss_mb']
+    old = pd.DataFrame(old['results']).reindex(columns=columns).set_index(['scale', 'function'])
+    new = pd.DataFrame(new['results']).reindex(columns=columns).set_index(['scale', 'function'])
+
+    df = old.join(new, how='outer', lsuffix='_old', rsuffix='_new')
+
+    for column in columns[2:]:
+        df[f'{column}_ratio'] = df[f'{column}_new'] / df[f'{column}_old']
+
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='run the benchmarks')
+    run_parser.add_argument('--scales', nargs='+', type=int, default=SCALES)
+    run_parser.add_argument('--functions', nargs='+', metavar='function', default=list(FUNCTIONS),
+                            help=f'one of {", ".join(FUNCTIONS)} (default: all)')
+    run_parser.add_argument('--repeat', type=int, default=5, help='number of warm runs')
+    run_parser.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'curricula-bench'),
+                            help='directory of the generated corpora')
+    run_parser.add_argument('--regenerate', action='store_true', help='generate the corpora again')
+    run_parser.add_argument('--output', help='result file (default: bench-<commit>.json)')
+
+    compare_parser = commands.add_parser('compare', help='compare two result files')
+    compare_parser.add_argument('old')
+    compare_parser.add_argument('new')
+
+    worker_parser = commands.add_parser('worker')
+    worker_parser.add_argument('function', choices=['build_store'] + list(FUNCTIONS))
+    worker_parser.add_argument('--repeat', type=int, default=5)
+
+    args = parser.parse_args()
+
+    if args.command == 'worker':
+        print(json.dumps(run_function(args.function, args.repeat)))
+
+    elif args.command == 'run':
+        unknown = set(args.functions) - set(FUNCTIONS)
+        if unknown:
+            parser.error(f'unknown functions: {", ".join(sorted(unknown))}')
+
+        result = run(args.scales, args.functions, args.repeat, args.workdir, args.regenerate)
+        output = args.output or f'bench-{result["commit"] or "local"}.json'
+
+        with open(output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+        columns = ['scale', 'n_sentences', 'function', 'load_s', 'cold_s', 'warm_median_s', 'load_rss_mb', 'peak_rss_mb']
+        print(pd.DataFrame(result['results']).reindex(columns=columns).to_string(index=False))
+        print(f'Written to {output}', file=sys.stderr)
+
+    elif args.command == 'compare':
+        with open(args.old) as f:
+            old = json.load(f)
+        with open(args.new) as f:
+            new = json.load(f)
+
+        print(compare(old, new).to_string(float_format='{:.4f}'.format))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+"""
+Bootstrap confidence intervals for the topic shares of the curricula.
+
+A replicate resamples the sentences of every curriculum with replacement and takes the mean of their topic
+probabilities, so the shares of a curriculum vary with the sampling of its sentences. Shares of several curricula
+(e.g. of a level) are means over the replicates of the single curricula.
+
+The replicates are computed once per data/model version (the bootstrap step of build.py) on a pool of processes
+and stored as one array (replicates × curricula × topics). ingest.py extends them with replicates of the new
+curricula.
+"""
+import functools
+import multiprocessing
+import os
+import threading
+
+import numpy as np
+
+import aggregates
+import artifacts
+import store
+
+REPLICATES = 2000
+
+CONFIDENCE = 0.95
+
+SEED = 0
+
+# Replicates per task of a worker
+TASK_SIZE = 100
+
+
+def bootstrap_name(version, replicates=REPLICATES):
+    return f'bootstrap-{replicates}-{version}'
+
+
+# Serializes the computation of missing replicates by the threads of a process
+_lock = threading.Lock()
+
+# Probabilities of a worker process, set by the initializer of the pool
+_probabilities = None
+
+
+def _init_worker(probabilities):
+    global _probabilities
+    _probabilities = probabilities
+
+
+def _worker_replicate(task):
+    return _replicate(_probabilities, task)
+
+
+def _replicate(all_probabilities, task):
+    """
+    :return:
+    Shares of the topics and OTHER_LABEL of every curriculum for n replicates (n × curricula × topics + 1)
+    """
+    seed, n, ranges = task
+    rng = np.random.default_rng(seed)
+
+    shares = np.empty((n, len(ranges), all_probabilities.shape[1] + 1), dtype=np.float32)
+
+    for c, (start, stop) in enumerate(ranges):
+        size = stop - start
+        probabilities = np.asarray(all_probabilities[start:stop], dtype=np.float64)
+
+        # How often each sentence is drawn in each replicate, so a replicate is one row of a matrix product
+        samples = rng.integers(0, size, size=(n, size)) + np.arange(n)[:, None] * size
+        counts = np.bincount(samples.ravel(), minlength=n * size).reshape(n, size)
+
+        means = counts @ probabilities / size
+
+        shares[:, c, :-1] = means
+        shares[:, c, -1] = 1 - means.sum(axis=1)
+
+    return shares
+
+
+def compute_replicates(probabilities, ranges, path, replicates=REPLICATES, processes=None, seed=SEED):
+    """
+    Writes the replicates of the curricula with the given row ranges to path. The result only depends on the
+    seed, not on the number of processes.
+    """
+    processes = processes or os.cpu_count()
+
+    sizes = [min(TASK_SIZE, replicates - start) for start in range(0, replicates, TASK_SIZE)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = [(s, n, ranges) for s, n in zip(seeds, sizes)]
+
+    tmp = path + '.tmp.npy'
+    out = np.lib.format.open_memmap(
+        tmp, mode='w+', dtype=np.float32, shape=(replicates, len(ranges), probabilities.shape[1] + 1)
+    )
+
+    def write(results):
+        start = 0
+        for shares in results:
+            out[start:start + len(shares)] = shares
+            start += len(shares)
+
+    if processes == 1:
+        write(map(functools.partial(_replicate, probabilities), tasks))
+    else:
+        # The forked workers inherit the (memory-mapped) probabilities instead of receiving them with every task
+        context = multiprocessing.get_context('fork')
+        with context.Pool(processes, initializer=_init_worker, initargs=(probabilities,)) as pool:
+            write(pool.imap(_worker_replicate, tasks))
+
+    out.flush()
+    del out
+
+    os.replace(tmp, path)
+
+
+class Bootstrap:
+    """
+    Replicates of the topic shares of the curricula, in the order of the rows of the cube.
+    """
+
+    def __init__(self, replicates, curricula, topics):
+        self.replicates = replicates
+        self.curricula = curricula
+        self.topics = list(topics)
+
+    def rows(self, level=None, states=None):
+        """
+        :return:
+        Indices of the curricula of the level (all by default) and the states (all by default)
+        """
+        return [
+            i for i, (state, l) in enumerate(self.curricula)
+            if level in (None, l) and (states is None or state in states)
+        ]
+
+    def means(self, rows):
+        """
+        :return:
+        Replicates of the mean shares of the curricula (replicates × topics)
+        """
+        return self.replicates[:, rows].mean(axis=1, dtype=np.float64)
+
+    @staticmethod
+    def interval(samples, confidence=CONFIDENCE):
+        """
+        :return:
+        Lower and upper bound of the percentile interval of each column
+        """
+        alpha = (1 - confidence) / 2
+        return np.quantile(samples, [alpha, 1 - alpha], axis=0)
+
+
+def load_bootstrap(probabilities, cube, curricula, version, processes=None, data_dir=store.DATA_DIR):
+    """
+    Loads the replicates for the given data/model version and computes them if they do not exist yet.
+
+    :param curricula:
+    CurriculumIndex with the row ranges of the curricula
+    """
+    path = store.array_path(bootstrap_name(version), data_dir)
+
+    with _lock:
+        if not os.path.exists(path):
+            os.makedirs(store.store_dir(data_dir), exist_ok=True)
+            ranges = [curricula.ranges[curriculum] for curriculum in cube.curricula]
+            compute_replicates(probabilities, ranges, path, processes=processes)
+
+    return Bootstrap(store.read_array(bootstrap_name(version), data_dir), cube.curricula, cube.topics)
+
+
+def extend_bootstrap(old_version, version, probabilities, old_curricula, cube, curricula, processes=None,
+                     data_dir=store.DATA_DIR):
+    """
+    Writes the replicates of the new version: those of the old version and new replicates of the curricula that
+    were added. The new replicates are drawn with a seed of their own, so they are independent of the old ones.
+
+    :param old_curricula:
+    (bundesland, stufe) of the curricula of the old replicates, in their order
+    :param cube:
+    Cube of the new version
+    :param curricula:
+    CurriculumIndex of the new version
+    """
+    old = store.read_array(bootstrap_name(old_version), data_dir)
+    added = [curriculum for curriculum in cube.curricula if curriculum not in set(old_curricula)]
+
+    path = store.array_path(bootstrap_name(version), data_dir)
+    compute_replicates(
+        probabilities, [curricula.ranges[curriculum] for curriculum in added], path + '.added.npy', len(old),
+        processes, seed=(SEED, len(old_curricula))
+    )
+
+    position = {curriculum: i for i, curriculum in enumerate(list(old_curricula) + added)}
+    replicates = np.concatenate([old, np.load(path + '.added.npy')], axis=1)
+
+    store.write_array(replicates[:, [position[curriculum] for curriculum in cube.curricula]], bootstrap_name(version),
+                      data_dir)
+    os.remove(path + '.added.npy')
+
+
+def build_bootstrap(data_dir=store.DATA_DIR, model_dir=artifacts.MODEL_DIR):
+    documents, df, duality = store.load_store(data_dir)
+    model = artifacts.load_artifacts(model_dir)
+    version = store.version(data_dir, model_dir)
+
+    cube = aggregates.load_cube(aggregates.topic_props(df, model), version, data_dir)
+
+    return load_bootstrap(model.probabilities_, cube, store.load_curricula(data_dir), version, data_dir=data_dir)
@@ -0,0 +1,49 @@
+"""
+Builds the precomputed artifacts the dashboard is served from.
+
+    python build.py            # all steps
+    python build.py store      # selected steps only
+"""
+import argparse
+
+import aggregates
+import artifacts
+import bootstrap
+import cooccurrence
+import duplicates
+import figures
+import projection
+import sentence_embeddings
+import store
+import topic_index
+
+STEPS = {
+    'store': store.build_store,
+    'artifacts': artifacts.export_artifacts,
+    'aggregates': aggregates.build_cube,
+    'bootstrap': bootstrap.build_bootstrap,
+    'topic_index': topic_index.build_topic_index,
+    'embeddings': sentence_embeddings.build_sentence_embeddings,
+    'projection': projection.build_projection,
+    'cooccurrence': cooccurrence.build_cooccurrence,
+    'duplicates': duplicates.build_duplicates,
+    'figures': figures.build_figures,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('steps', nargs='*', metavar='step', help=f'one of {", ".join(STEPS)} (default: all)')
+    args = parser.parse_args()
+
+    unknown = set(args.steps) - set(STEPS)
+    if unknown:
+        parser.error(f'unknown steps: {", ".join(sorted(unknown))}')
+
+    for name in args.steps or STEPS:
+        print(f'Building {name} ...')
+        STEPS[name]()
+
+
+if __name__ == '__main__':
+    main()
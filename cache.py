@@ -0,0 +1,230 @@
+import functools
+import inspect
+import sys
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from pympler import asizeof
+
+# All caches of the process, for stats()
+CACHES = weakref.WeakSet()
+
+# Guards the creation of the caches of instances
+_instance_lock = threading.Lock()
+
+
+def copy_on_read(value):
+    """
+    Protects cached values from being modified by the caller.
+    DataFrames are copied, arrays are handed out as read-only views. Figures are shared, since copying one costs
+    more than rendering it and the dashboard only serializes them; callers must not modify a cached figure.
+    """
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return value.copy()
+
+    if isinstance(value, np.ndarray):
+        view = value.view()
+        view.flags.writeable = False
+        return view
+
+    return value
+
+
+def sizeof(value):
+    """
+    Memory used by a cached value in bytes. Pympler is used for everything that is not a
+    DataFrame or array, whose sizes pandas and numpy report more cheaply.
+    """
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True))
+
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+
+    if isinstance(value, tuple):
+        return sys.getsizeof(value) + sum(sizeof(item) for item in value)
+
+    try:
+        return asizeof.asizeof(value)
+    except (TypeError, ValueError):
+        return sys.getsizeof(value)
+
+
+class Cache:
+    """
+    LRU cache with an optional time-to-live.
+    The size of every entry is measured when it is inserted (see sizeof).
+    """
+
+    def __init__(self, name, maxsize=128, ttl=None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.lock = threading.RLock()
+
+        # Locks of the keys being computed, so concurrent misses of one key compute it once
+        self.pending = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        CACHES.add(self)
+
+    def _remove(self, key):
+        value, expires, nbytes = self.entries.pop(key)
+        self.nbytes -= nbytes
+
+    def _lookup(self, key):
+        entry = self.entries.get(key)
+
+        if entry is not None and entry[1] is not None and entry[1] < time.monotonic():
+            self._remove(key)
+            entry = None
+
+        if entry is None:
+            return False, None
+
+        self.entries.move_to_end(key)
+        return True, entry[0]
+
+    def get(self, key):
+        """
+        :return:
+        (True, value) on a hit, (False, None) on a miss
+        """
+        with self.lock:
+            hit, value = self._lookup(key)
+
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+            return hit, value
+
+    def get_or_compute(self, key, compute):
+        """
+        :return:
+        The cached value of the key, computed by compute() on a miss. Threads that miss the key while it is being
+        computed wait for the result instead of computing it again.
+        """
+        hit, value = self.get(key)
+
+        if hit:
+            return value
+
+        with self.lock:
+            pending = self.pending.setdefault(key, threading.Lock())
+
+        with pending:
+            with self.lock:
+                hit, value = self._lookup(key)
+
+            if not hit:
+                try:
+                    value = compute()
+                    self.put(key, value)
+                finally:
+                    with self.lock:
+                        self.pending.pop(key, None)
+
+        return value
+
+    def put(self, key, value):
+        nbytes = sizeof(value)
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+
+            self.entries[key] = (value, expires, nbytes)
+            self.nbytes += nbytes
+
+            while len(self.entries) > self.maxsize:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                'name': self.name,
+                'entries': len(self.entries),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'bytes': self.nbytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+
+def cached(maxsize=128, ttl=None, copy=True):
+    """
+    Caches the results of a function (or method, with one cache per instance).
+
+    :param copy:
+    Hand out copies of cached results (see copy_on_read). Disable for shared read-only resources.
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+        is_method = 'self' in signature.parameters
+
+        def key(args, kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            return tuple((name, value) for name, value in bound.arguments.items() if name != 'self')
+
+        def get_cache(args):
+            if not is_method:
+                return wrapper.cache
+
+            with _instance_lock:
+                caches = args[0].__dict__.setdefault('_caches', {})
+
+                if func.__name__ not in caches:
+                    caches[func.__name__] = Cache(func.__qualname__, maxsize, ttl)
+
+                return caches[func.__name__]
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            cache = get_cache(args)
+            k = key(args, kwargs)
+
+            value = cache.get_or_compute(k, lambda: func(*args, **kwargs))
+
+            return copy_on_read(value) if copy else value
+
+        wrapper.cache = None if is_method else Cache(func.__qualname__, maxsize, ttl)
+
+        return wrapper
+
+    return decorator
+
+
+def stats():
+    """
+    :return:
+    DataFrame with the statistics of all caches of this process
+    """
+    rows = [cache.stats() for cache in list(CACHES)]
+    return pd.DataFrame(rows, columns=[
+        'name', 'entries', 'maxsize', 'ttl', 'bytes', 'hits', 'misses', 'evictions'
+    ]).sort_values('name', ignore_index=True)
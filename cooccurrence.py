@@ -0,0 +1,183 @@
+"""
+Co-occurrence of the topics within the sections (titel) of the curricula.
+
+A section contains a topic if at least one of its sentences is assigned to it. For every curriculum the number of
+sections that contain a pair of topics is counted with one sparse matrix product over all curricula. Counts and
+numbers of sections add up, so the co-occurrence of any set of curricula (a level, a state, all) is a sum over the
+stored counts; the lift is computed from the sums.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+import scipy.sparse as sp
+
+import artifacts
+import store
+
+GROUPS = ['bundesland', 'stufe']
+
+# Lift shown for the pairs of topics that never occur together, whose log2 lift is -inf
+LIFT_FLOOR = 1 / 32
+
+
+def cooccurrence_name(version):
+    return f'cooccurrence-{version}'
+
+
+def section_topics(df, topics, n_topics):
+    """
+    :param topics:
+    Topic of every sentence, -1 for outliers
+    :return:
+    Sections (document ids) and the binary sparse matrix sections × topics
+    """
+    topics = np.asarray(topics)
+    assigned = topics >= 0
+
+    sections, rows = np.unique(df['document'].to_numpy(), return_inverse=True)
+
+    X = sp.csr_matrix(
+        (np.ones(assigned.sum(), dtype=np.int64), (rows[assigned], topics[assigned])),
+        shape=(len(sections), n_topics)
+    )
+    X.data[:] = 1
+
+    return sections, X
+
+
+def count_cooccurrence(df, topics, n_topics):
+    """
+    :return:
+    DataFrame with bundesland, stufe, the number of sections of the curriculum, topic_a <= topic_b and the
+    number of sections that contain both (topic_a == topic_b: the sections that contain the topic)
+    """
+    sections, X = section_topics(df, topics, n_topics)
+
+    documents = df.drop_duplicates('document').set_index('document').loc[sections, GROUPS]
+    codes, curricula = pd.MultiIndex.from_frame(documents.astype(str)).factorize(sort=True)
+
+    # Places the topics of each section in the block of its curriculum, so one product (curricula · topics) × topics
+    # yields the co-occurrence matrices of all curricula
+    X = X.tocoo()
+    blocks = sp.csr_matrix(
+        (X.data, (X.row, codes[X.row] * n_topics + X.col)),
+        shape=(X.shape[0], len(curricula) * n_topics)
+    )
+
+    C = (blocks.T @ X.tocsr()).tocoo()
+
+    curriculum, topic_a = np.divmod(C.row, n_topics)
+    upper = topic_a <= C.col
+
+    n_sections = np.bincount(codes, minlength=len(curricula))
+
+    return pd.DataFrame({
+        'bundesland': curricula.get_level_values(0)[curriculum[upper]],
+        'stufe': curricula.get_level_values(1)[curriculum[upper]],
+        'sections': n_sections[curriculum[upper]],
+        'topic_a': topic_a[upper],
+        'topic_b': C.col[upper],
+        'count': C.data[upper],
+    })
+
+
+class Cooccurrence:
+    """
+    Co-occurrence counts of the topics per curriculum.
+    """
+
+    def __init__(self, counts, labels):
+        self.counts = counts
+        self.labels = list(labels)
+
+    def select(self, state=None, level=None):
+        counts = self.counts
+
+        if state is not None:
+            counts = counts[counts['bundesland'] == state]
+        if level is not None:
+            counts = counts[counts['stufe'] == level]
+
+        return counts
+
+    def matrix(self, state=None, level=None):
+        """
+        :return:
+        Symmetric matrix of the number of sections containing both topics (topics × topics) and the number of
+        sections of the selected curricula
+        """
+        counts = self.select(state, level)
+        n = len(self.labels)
+
+        C = np.zeros((n, n))
+        np.add.at(C, (counts['topic_a'].to_numpy(), counts['topic_b'].to_numpy()), counts['count'].to_numpy())
+        C = C + np.triu(C, 1).T
+
+        n_sections = counts.drop_duplicates(GROUPS)['sections'].sum()
+
+        return pd.DataFrame(C, index=self.labels, columns=self.labels), int(n_sections)
+
+    def lift(self, state=None, level=None):
+        """
+        :return:
+        P(a, b) / (P(a) P(b)) of sections containing the topics; 1 means the topics are independent, NaN that
+        one of them does not occur
+        """
+        C, n_sections = self.matrix(state, level)
+
+        occurrence = np.diag(C.to_numpy())
+        with np.errstate(divide='ignore', invalid='ignore'):
+            lift = C.to_numpy() * n_sections / np.outer(occurrence, occurrence)
+
+        return pd.DataFrame(np.where(np.isfinite(lift), lift, np.nan), index=self.labels, columns=self.labels)
+
+
+def load_cooccurrence(df, model, version, data_dir=store.DATA_DIR):
+    """
+    Loads the counts for the given data/model version and counts them if they do not exist yet.
+    """
+    name = cooccurrence_name(version)
+    labels = model.get_topic_info()['CustomName'].tolist()[1:]
+
+    if not os.path.exists(store.table_path(name, data_dir)):
+        store.write_table(count_cooccurrence(df, model.topics_, len(labels)), name, data_dir)
+
+    return Cooccurrence(store.load_table(name, data_dir=data_dir), labels)
+
+
+def build_cooccurrence(data_dir=store.DATA_DIR, model_dir=artifacts.MODEL_DIR):
+    documents, df, duality = store.load_store(data_dir)
+    model = artifacts.load_artifacts(model_dir)
+
+    counts = count_cooccurrence(df, model.topics_, len(model.get_topic_info()) - 1)
+    store.write_table(counts, cooccurrence_name(store.version(data_dir, model_dir)), data_dir)
+
+
+def plot_lift(lift, counts):
+    """
+    Heatmap of the log2 lift of the topic pairs, with the lift and number of sections on hover. Pairs that never
+    occur together (lift 0) are shown at log2(LIFT_FLOOR).
+    """
+    with np.errstate(divide='ignore'):
+        z = np.log2(np.clip(lift.to_numpy(), LIFT_FLOOR, None))
+
+    limit = np.nanmax(np.abs(z[np.isfinite(z)])) if np.isfinite(z).any() else 1
+
+    return go.Figure(
+        go.Heatmap(
+            z=np.where(np.isfinite(z), z, np.nan),
+            x=lift.columns,
+            y=lift.index,
+            customdata=np.dstack([lift.to_numpy(), counts.to_numpy()]),
+            colorscale='RdBu',
+            reversescale=True,
+            zmid=0,
+            zmin=-limit,
+            zmax=limit,
+            colorbar=dict(title=f'log2 Lift<br>({np.log2(LIFT_FLOOR):.0f}: Lift 0 bis {LIFT_FLOOR:.2f})'),
+            hovertemplate='%{y}<br>%{x}<br>Lift: %{customdata[0]:.2f}<br>Abschnitte: %{customdata[1]:.0f}'
+                          '<extra></extra>',
+        )
+    )
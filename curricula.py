@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+
+GROUPS = ['bundesland', 'stufe']
+
+
+def render_curricula(df):
+    """
+    Renders the sections of every curriculum as markdown.
+
+    Sentences are ordered by document and the documents of a curriculum are consecutive,
+    so each curriculum occupies a contiguous range of rows [start, stop).
+
+    :return:
+    DataFrame with one row per (bundesland, stufe, titel)
+    """
+    positions = pd.Series(np.arange(len(df)), index=df.index)
+
+    bounds = positions.groupby([df[column] for column in GROUPS], observed=True).agg(['min', 'max', 'count'])
+
+    if (bounds['max'] - bounds['min'] + 1 != bounds['count']).any():
+        raise ValueError('Sentences of a curriculum are not stored contiguously')
+
+    bounds = pd.DataFrame({
+        'start': bounds['min'],
+        'stop': bounds['max'] + 1
+    })
+
+    sections = df.groupby(GROUPS + ['titel'], observed=True)['raw_sentence'].agg('  \n'.join)
+    sections = sections.rename('markdown').reset_index()
+
+    sections = sections.merge(bounds, left_on=GROUPS, right_index=True)
+
+    for column in GROUPS + ['titel']:
+        sections[column] = sections[column].astype(str)
+
+    return sections[GROUPS + ['start', 'stop', 'titel', 'markdown']]
+
+
+class CurriculumIndex:
+    """
+    Maps (bundesland, stufe) to the row range of the curriculum and its rendered sections.
+    """
+
+    def __init__(self, sections):
+        self.ranges = {}
+        self.sections = {}
+
+        for (state, level), group in sections.groupby(GROUPS, sort=False):
+            self.ranges[state, level] = (int(group['start'].iloc[0]), int(group['stop'].iloc[0]))
+            self.sections[state, level] = list(zip(group['titel'], group['markdown']))
+
+    def rows(self, state, level):
+        """
+        :return:
+        slice of the rows of the curriculum (empty if it does not exist)
+        """
+        start, stop = self.ranges.get((state, level), (0, 0))
+        return slice(start, stop)
+
+    def select(self, state=None, level=None):
+        """
+        :return:
+        Row ranges (start, stop) of the curricula matching state and level, None matches all
+        """
+        return sorted(
+            bounds for (s, l), bounds in self.ranges.items()
+            if state in (None, s) and level in (None, l)
+        )
+
+    def text(self, state, level):
+        """
+        :return:
+        List of (titel, markdown) of the sections of the curriculum
+        """
+        return self.sections.get((state, level), [])
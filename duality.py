@@ -0,0 +1,186 @@
+"""
+Scores the phrases on the two sides of the duality of computing systems, their architecture (how they are built and
+work) and their relevance (what they mean for people and society), and on the connection of both.
+
+    python duality.py      # recomputes data/duality.json for the sentences in the store
+
+A score is the cosine similarity of the sentence embedding to the anchor of the column, the normalized mean embedding
+of its ANCHORS phrases. The anchors are embedded once per model and stored with the model artifacts; scoring is one
+matrix product per chunk of sentences.
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+import artifacts
+import sentence_embeddings
+import store
+
+# Phrases describing each side; their embeddings are averaged into one anchor per score
+ANCHORS = {
+    'architecture': [
+        'Aufbau und Funktionsweise von Informatiksystemen',
+        'Algorithmen, Datenstrukturen und Programme entwerfen und implementieren',
+        'technische Grundlagen von Rechnern und Netzwerken',
+    ],
+    'relevance': [
+        'Bedeutung von Informatiksystemen für den Alltag und die Lebenswelt',
+        'Auswirkungen der Digitalisierung auf Mensch und Gesellschaft',
+        'Chancen und Risiken von Informatiksystemen bewerten',
+    ],
+    'connection': [
+        'Zusammenhang zwischen der Funktionsweise von Informatiksystemen und ihren Wirkungen auf die Gesellschaft',
+        'technische Entscheidungen im Hinblick auf ihre gesellschaftlichen Folgen beurteilen',
+    ],
+}
+
+COLUMNS = list(ANCHORS)
+
+# Sentences per matrix product
+CHUNK_ROWS = 1 << 16
+
+
+def anchor_texts():
+    return [text for texts in ANCHORS.values() for text in texts]
+
+
+def normalize(embeddings):
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    return embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+
+
+def anchor_matrix(anchor_embeddings):
+    """
+    :param anchor_embeddings:
+    Embeddings of anchor_texts(), in that order
+
+    :return:
+    One normalized anchor per score (len(COLUMNS) × dimensions)
+    """
+    anchor_embeddings = normalize(anchor_embeddings)
+    bounds = np.cumsum([0] + [len(texts) for texts in ANCHORS.values()])
+
+    return normalize([anchor_embeddings[start:stop].mean(axis=0) for start, stop in zip(bounds[:-1], bounds[1:])])
+
+
+def score(embeddings, anchors):
+    """
+    :return:
+    Cosine similarity of every phrase to every anchor (len(embeddings) × len(COLUMNS))
+    """
+    return normalize(embeddings) @ anchors.T
+
+
+def score_chunks(embeddings, anchors, chunk_rows=CHUNK_ROWS):
+    """
+    Scores memory-mapped or float16 embeddings chunk by chunk, so only one chunk is converted at a time.
+
+    :return:
+    float32 scores (len(embeddings) × len(COLUMNS))
+    """
+    scores = np.empty((len(embeddings), len(COLUMNS)), dtype=np.float32)
+
+    for start in range(0, len(embeddings), chunk_rows):
+        scores[start:start + chunk_rows] = score(embeddings[start:start + chunk_rows], anchors)
+
+    return scores
+
+
+def anchors_key(model_dir=artifacts.MODEL_DIR):
+    # The anchors depend on the phrases and the embedding model
+    return hashlib.sha256(json.dumps([ANCHORS, artifacts.model_fingerprint(model_dir)]).encode()).hexdigest()[:16]
+
+
+def anchors_path(model_dir=artifacts.MODEL_DIR):
+    return artifacts.artifact_path(f'duality_anchors-{anchors_key(model_dir)}.npy', model_dir)
+
+
+def record_path(data_dir=store.DATA_DIR):
+    return os.path.join(data_dir, 'duality_anchors.json')
+
+
+def write_scores(scores, data_dir=store.DATA_DIR, model_dir=artifacts.MODEL_DIR):
+    """
+    Writes the scores to duality.json and records the anchors they were computed with.
+    """
+    path = store.source_path('duality', data_dir)
+    scores.to_json(path)
+
+    with open(record_path(data_dir), 'w') as f:
+        json.dump({'anchors': anchors_key(model_dir), 'duality': store.file_hash(path)}, f, indent=2)
+
+
+def scored_anchors(data_dir=store.DATA_DIR):
+    """
+    :return:
+    Key of the anchors all scores in duality.json were computed with, None if they were not computed by
+    write_scores (e.g. the shipped scores) or duality.json changed since
+    """
+    if not os.path.exists(record_path(data_dir)):
+        return None
+
+    with open(record_path(data_dir)) as f:
+        record = json.load(f)
+
+    return record['anchors'] if record['duality'] == store.file_hash(store.source_path('duality', data_dir)) else None
+
+
+def load_anchors(embed, model_dir=artifacts.MODEL_DIR):
+    """
+    :param embed:
+    Function that embeds a list of texts, only called if the anchors of the model are not stored yet
+    :return:
+    The anchor matrix of the model
+    """
+    path = anchors_path(model_dir)
+
+    if not os.path.exists(path):
+        anchors = anchor_matrix(embed(anchor_texts()))
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'wb') as f:
+            np.save(f, anchors)
+        os.replace(path + '.tmp', path)
+
+    return np.load(path)
+
+
+def build_duality(data_dir=store.DATA_DIR, model_dir=artifacts.MODEL_DIR):
+    """
+    Recomputes the scores of all sentences in the store and writes them to duality.json and the store.
+    """
+    topic_model = None
+
+    def load_topic_model():
+        nonlocal topic_model
+        if topic_model is None:
+            topic_model = artifacts.load_topic_model(model_dir)
+        return topic_model
+
+    old_version = store.version(data_dir, model_dir)
+
+    embeddings = sentence_embeddings.load_sentence_embeddings(old_version, data_dir)
+    if embeddings is None:
+        documents, df, duality = store.load_store(data_dir)
+        embeddings = sentence_embeddings.embed_sentences(df['sentence'].tolist(), old_version, load_topic_model(),
+                                                         data_dir=data_dir)
+
+    anchors = load_anchors(lambda texts: sentence_embeddings.encode(load_topic_model(), texts, processes=1), model_dir)
+
+    write_scores(pd.DataFrame(score_chunks(embeddings, anchors), columns=COLUMNS), data_dir, model_dir)
+    del embeddings
+
+    store.build_store(data_dir)
+    version = store.version(data_dir, model_dir)
+
+    # The embeddings only depend on the sentences and the model, so they are kept for the new version
+    name = sentence_embeddings.embeddings_name
+    if os.path.exists(store.array_path(name(old_version), data_dir)):
+        os.replace(store.array_path(name(old_version), data_dir), store.array_path(name(version), data_dir))
+
+
+if __name__ == '__main__':
+    build_duality()
@@ -0,0 +1,267 @@
+"""
+Near-duplicate phrases across the curricula, found with MinHash and locality-sensitive hashing.
+
+    python duplicates.py                       # writes the clusters to duplicates.csv
+    python duplicates.py --output shared.json
+
+A phrase (raw_sentence) is the set of the character shingles of its normalized text. Its MinHash signature holds
+the minimum of each of PERMUTATIONS hash functions over the shingles; two signatures agree in a position with the
+probability of the Jaccard similarity of the phrases. The signatures are split into BANDS bands, and phrases with an
+equal band land in the same bucket. Each phrase is paired with the first phrase of each of its buckets, so the
+candidate pairs grow linearly with the phrases instead of quadratically. Candidates whose signatures agree in at
+least THRESHOLD of the positions are linked, and the connected phrases form a cluster.
+"""
+import argparse
+import multiprocessing
+import os
+import re
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from scipy.sparse.csgraph import connected_components
+
+import artifacts
+import store
+
+SHINGLE_SIZE = 5
+
+PERMUTATIONS = 128
+
+# 32 bands of 4 rows: pairs with a Jaccard similarity of 0.7 become candidates with a probability above 0.99
+BANDS = 32
+
+THRESHOLD = 0.7
+
+# Clusters must contain phrases of at least this many curricula
+MIN_CURRICULA = 2
+
+# Shingles per batch, bounds the intermediate array (shingles × permutations) to 64 MB
+BATCH_SHINGLES = 1 << 16
+
+SEED = 0
+
+
+def duplicates_name(version):
+    return f'duplicates-{version}'
+
+
+def normalize(text):
+    return re.sub(r'\W+', ' ', str(text).lower()).strip()
+
+
+def hash_functions(permutations=PERMUTATIONS, seed=SEED):
+    """
+    :return:
+    Odd multipliers and offsets of the multiply-shift hash functions (x * a + b) >> 32 on 64 bits
+    """
+    rng = np.random.default_rng(seed)
+    a = rng.integers(0, 1 << 63, permutations, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+    b = rng.integers(0, 1 << 63, permutations, dtype=np.uint64)
+    return a, b
+
+
+def shingle_hashes(texts, size=SHINGLE_SIZE):
+    """
+    :param texts:
+    Normalized texts of at least size characters
+    :return:
+    64 bit hashes of the shingles (texts × shingles of the longest text), shorter texts repeat their last shingle
+    """
+    width = max(len(text) for text in texts)
+    n = width - size + 1
+
+    codes = np.frombuffer(''.join(text.ljust(width) for text in texts).encode('utf-32-le'), dtype=np.uint32)
+    codes = codes.reshape(len(texts), width).astype(np.uint64)
+
+    hashes = np.zeros((len(texts), n), dtype=np.uint64)
+    for offset in range(size):
+        hashes = hashes * np.uint64(1000003) + codes[:, offset:offset + n]
+
+    counts = np.array([len(text) for text in texts]) - size + 1
+    return np.take_along_axis(hashes, np.minimum(np.arange(n), counts[:, None] - 1), axis=1)
+
+
+def _minhash(task):
+    texts, size, permutations, seed = task
+    a, b = hash_functions(permutations, seed)
+
+    with np.errstate(over='ignore'):
+        values = shingle_hashes(texts, size)[:, :, None] * a
+        values += b
+
+    # The shift is monotonic, so it is applied to the minima only
+    return (values.min(axis=1) >> np.uint64(32)).astype(np.uint32)
+
+
+def signatures(texts, size=SHINGLE_SIZE, permutations=PERMUTATIONS, processes=None, batch_shingles=BATCH_SHINGLES,
+               seed=SEED):
+    """
+    Computes the signatures of batches of texts of similar length (as sentence_embeddings.batches), so little
+    padding is hashed.
+
+    :param texts:
+    Normalized, non-empty texts
+    :param processes:
+    Number of worker processes (default: one per core)
+    :return:
+    MinHash signatures (texts × permutations)
+    """
+    processes = processes or os.cpu_count()
+
+    texts = [text.ljust(size) for text in texts]
+    order = np.argsort([-len(text) for text in texts], kind='stable')
+
+    batches = []
+    start = 0
+    while start < len(order):
+        stop = start + max(1, batch_shingles // (len(texts[order[start]]) - size + 1))
+        batches.append(order[start:stop])
+        start = stop
+
+    tasks = (([texts[i] for i in batch], size, permutations, seed) for batch in batches)
+    result = np.empty((len(texts), permutations), dtype=np.uint32)
+
+    def write(results):
+        for batch, signature in zip(batches, results):
+            result[batch] = signature
+
+    if processes == 1:
+        write(map(_minhash, tasks))
+    else:
+        with multiprocessing.get_context('fork').Pool(processes) as pool:
+            write(pool.imap(_minhash, tasks))
+
+    return result
+
+
+def candidate_pairs(signatures, bands=BANDS, seed=SEED):
+    """
+    :return:
+    Pairs (first, second) of the rows that share a bucket in at least one band, every row paired with the first
+    row of its bucket
+    """
+    rows = signatures.shape[1] // bands
+    multipliers, _ = hash_functions(rows, seed + 1)
+    pairs = []
+
+    for band in range(bands):
+        # Rows with equal bands get equal keys; the rare collisions of unequal bands fail the similarity check
+        with np.errstate(over='ignore'):
+            keys = (signatures[:, band * rows:(band + 1) * rows].astype(np.uint64) * multipliers).sum(axis=1)
+
+        _, first, bucket = np.unique(keys, return_index=True, return_inverse=True)
+
+        first = first[bucket]
+        other = first != np.arange(len(signatures))
+        pairs.append(np.stack([first[other], np.flatnonzero(other)], axis=1))
+
+    pairs = np.concatenate(pairs) if pairs else np.empty((0, 2), dtype=np.int64)
+    return np.unique(pairs, axis=0)
+
+
+def similar_pairs(signatures, pairs, threshold=THRESHOLD):
+    """
+    :return:
+    The pairs whose signatures agree in at least threshold of the positions (the estimated Jaccard similarity)
+    """
+    similarity = (signatures[pairs[:, 0]] == signatures[pairs[:, 1]]).mean(axis=1)
+    return pairs[similarity >= threshold]
+
+
+def find_duplicates(df, threshold=THRESHOLD, bands=BANDS, min_curricula=MIN_CURRICULA, processes=None):
+    """
+    :return:
+    DataFrame with the cluster, bundesland, stufe, titel and raw_sentence of the phrases in clusters of near
+    duplicates, the clusters ordered by the number of their curricula; the index holds the rows of df
+    """
+    texts = df['raw_sentence'].map(normalize)
+
+    # Identical texts share a signature, so each is hashed once
+    codes, unique = pd.factorize(texts)
+    valid = np.flatnonzero(unique.str.len() > 0)
+
+    S = signatures(list(unique[valid]), processes=processes)
+    pairs = valid[similar_pairs(S, candidate_pairs(S, bands), threshold)]
+
+    graph = sp.coo_matrix((np.ones(len(pairs)), (pairs[:, 0], pairs[:, 1])), shape=(len(unique), len(unique)))
+    _, labels = connected_components(graph, directed=False)
+
+    result = df[['bundesland', 'stufe', 'titel', 'raw_sentence']].astype(str)
+    result.insert(0, 'cluster', labels[codes])
+    result = result[np.isin(codes, valid)]
+
+    n_curricula = result['cluster'].map(count_curricula(result))
+    result = result[n_curricula >= min_curricula]
+
+    # Renumbers the clusters from the one shared by the most curricula
+    order = n_curricula[result.index].groupby(result['cluster']).first().sort_values(ascending=False, kind='stable')
+    result['cluster'] = result['cluster'].map(pd.Series(np.arange(len(order)), index=order.index))
+
+    return result.sort_values(['cluster', 'bundesland', 'stufe'], kind='stable')
+
+
+def count_curricula(duplicates):
+    """
+    :return:
+    Number of curricula per cluster
+    """
+    return duplicates.drop_duplicates(['cluster', 'bundesland', 'stufe']).groupby('cluster').size()
+
+
+def summarize(duplicates):
+    """
+    :return:
+    One row per cluster with the first phrase, the number of phrases and curricula and the states
+    """
+    groups = duplicates.groupby('cluster', sort=True)
+
+    return pd.DataFrame({
+        'Phrase': groups['raw_sentence'].first(),
+        'Phrasen': groups.size(),
+        'Lehrpläne': count_curricula(duplicates),
+        'Bundesländer': groups['bundesland'].agg(lambda states: ', '.join(sorted(set(states)))),
+    })
+
+
+def load_duplicates(df, version, processes=None, data_dir=store.DATA_DIR):
+    """
+    Loads the clusters for the given data/model version and finds them if they do not exist yet.
+    """
+    name = duplicates_name(version)
+
+    if not os.path.exists(store.table_path(name, data_dir)):
+        store.write_table(find_duplicates(df, processes=processes).reset_index(names='row'), name, data_dir)
+
+    return store.load_table(name, data_dir=data_dir).set_index('row').rename_axis(None)
+
+
+def build_duplicates(data_dir=store.DATA_DIR, model_dir=artifacts.MODEL_DIR):
+    documents, df, duality = store.load_store(data_dir)
+    return load_duplicates(df, store.version(data_dir, model_dir), data_dir=data_dir)
+
+
+def export_duplicates(duplicates, path):
+    """
+    Writes the clusters as CSV or, for a .json path, as JSON records.
+    """
+    if path.endswith('.json'):
+        duplicates.to_json(path, orient='records', force_ascii=False)
+    else:
+        duplicates.to_csv(path, index=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', default='duplicates.csv', help='CSV or JSON file (default: duplicates.csv)')
+    args = parser.parse_args()
+
+    documents, df, duality = store.load_store()
+    duplicates = load_duplicates(df, store.version())
+
+    export_duplicates(duplicates, args.output)
+    print(f'Written {duplicates["cluster"].nunique()} clusters with {len(duplicates)} phrases to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+import store
+
+
+def normalize(text):
+    return ' '.join(text.lower().split())
+
+
+def cache_path(fingerprint, data_dir=store.DATA_DIR):
+    """
+    :param fingerprint:
+    Fingerprint of the topic model (artifacts.model_fingerprint); the embeddings only depend on its embedding model,
+    so the cache outlives new versions of the data and artifacts
+    """
+    return os.path.join(data_dir, 'cache', f'embeddings-{fingerprint}.sqlite')
+
+
+class EmbeddingCache:
+    """
+    Embeddings of search queries, persisted in a sqlite database and keyed on the normalized query.
+
+    The database is shared by all sessions and processes that use the same path. When it holds more
+    than maxsize embeddings, the least recently used ones are evicted. Hits and misses are counted
+    per process and in the database.
+    """
+
+    def __init__(self, path, maxsize=100_000):
+        self.path = path
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+
+        with self.lock:
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS embeddings '
+                '(key TEXT PRIMARY KEY, dim INTEGER, vector BLOB, last_used REAL)'
+            )
+            self.connection.execute('CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER)')
+            self.connection.execute("INSERT OR IGNORE INTO counters VALUES ('hits', 0), ('misses', 0)")
+
+    def get(self, keys):
+        """
+        :return:
+        dict of the cached embeddings among keys
+        """
+        if not keys:
+            return {}
+
+        placeholders = ','.join('?' * len(keys))
+
+        with self.lock:
+            rows = self.connection.execute(
+                f'SELECT key, vector FROM embeddings WHERE key IN ({placeholders})', keys
+            ).fetchall()
+
+            found = {key: np.frombuffer(vector, dtype=np.float32) for key, vector in rows}
+
+            if found:
+                self.connection.execute(
+                    f'UPDATE embeddings SET last_used = ? WHERE key IN ({",".join("?" * len(found))})',
+                    [time.time(), *found]
+                )
+
+        return found
+
+    def put(self, embeddings):
+        now = time.time()
+
+        rows = [
+            (key, len(vector), np.asarray(vector, dtype=np.float32).tobytes(), now)
+            for key, vector in embeddings.items()
+        ]
+
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            self.connection.executemany('INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)', rows)
+
+            size = self.connection.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
+
+            if size > self.maxsize:
+                self.connection.execute(
+                    'DELETE FROM embeddings WHERE key IN '
+                    '(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)',
+                    (size - self.maxsize,)
+                )
+
+            self.connection.execute('COMMIT')
+
+    def count(self, hits, misses):
+        self.hits += hits
+        self.misses += misses
+
+        with self.lock:
+            self.connection.executemany(
+                'UPDATE counters SET value = value + ? WHERE name = ?',
+                [(hits, 'hits'), (misses, 'misses')]
+            )
+
+    def embed(self, texts, compute):
+        """
+        :param compute:
+        Function embedding a list of texts, only called for the texts that are not cached
+        :return:
+        Array with one embedding per text
+        """
+        keys = [normalize(text) for text in texts]
+
+        found = self.get(list(set(keys)))
+        missing = sorted(set(keys) - set(found))
+
+        if missing:
+            computed = dict(zip(missing, np.asarray(compute(missing), dtype=np.float32)))
+            self.put(computed)
+            found.update(computed)
+
+        self.count(len(set(keys)) - len(missing), len(missing))
+
+        return np.stack([found[key] for key in keys])
+
+    def stats(self):
+        with self.lock:
+            totals = dict(self.connection.execute('SELECT name, value FROM counters').fetchall())
+            size = self.connection.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
+
+        return {
+            'size': size,
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'total_hits': totals['hits'],
+            'total_misses': totals['misses']
+        }
@@ -0,0 +1,144 @@
+import functools
+import hashlib
+import inspect
+import os
+import re
+
+import plotly.io as pio
+
+import hierarchy
+import store
+
+# Modules in this directory are part of the code of the figures
+CODE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Code keys of the modules that define figure functions, computed once per process
+_code_keys = {}
+
+# Figure functions that are rendered by build_figures, with the arguments to render them for
+REGISTRY = {}
+
+
+def figures_dir(version, data_dir=store.DATA_DIR):
+    return os.path.join(data_dir, 'figures', version)
+
+
+def code_key(module_globals):
+    """
+    Hash of the sources of a module and the modules of this directory it imports, and of the topic hierarchy,
+    which is no part of the data/model version. The figures of that module depend on nothing else.
+    """
+    name = module_globals['__name__']
+
+    if name not in _code_keys:
+        modules = [value for value in module_globals.values() if inspect.ismodule(value)]
+        paths = {os.path.abspath(module_globals['__file__'])} | {
+            os.path.abspath(module.__file__) for module in modules
+            if getattr(module, '__file__', None) and os.path.dirname(os.path.abspath(module.__file__)) == CODE_DIR
+        }
+
+        h = hashlib.sha256()
+        for path in sorted(paths) + [hierarchy.hierarchy_path()]:
+            if os.path.exists(path):
+                h.update(os.path.basename(path).encode())
+                h.update(store.file_hash(path).encode())
+
+        _code_keys[name] = h.hexdigest()[:8]
+
+    return _code_keys[name]
+
+
+def figure_key(name, arguments, code):
+    """
+    File name for a figure, readable but unique for every combination of arguments and the code of the figure
+    (see code_key), so figures are rendered again after their code changed.
+    """
+    name = f'{name}-{code}'
+
+    if not arguments:
+        return name
+
+    text = ','.join(f'{key}={value!r}' for key, value in arguments.items())
+    slug = re.sub(r'[^A-Za-z0-9]+', '_', text).strip('_')
+    digest = hashlib.sha1(text.encode()).hexdigest()[:8]
+
+    return f'{name}-{slug}-{digest}'
+
+
+def read_figure(path):
+    with open(path, encoding='utf-8') as f:
+        return pio.from_json(f.read())
+
+
+def write_figure(fig, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(pio.to_json(fig))
+
+    os.replace(tmp, path)
+
+
+def stored(grid=({},)):
+    """
+    Serves the figure from the figure store of the data/model version the analysis was loaded for, the version
+    attribute of the instance for methods and the version global of the module for functions. A process that loaded
+    its data before the data changed keeps using the store of the old version.
+    On a miss, the figure is computed and written to the store for other processes.
+
+    :param grid:
+    Keyword arguments the figure is rendered for at build time
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        def path(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            arguments = {key: value for key, value in bound.arguments.items() if key != 'self'}
+
+            version = bound.arguments['self'].version if 'self' in bound.arguments else func.__globals__['version']
+
+            key = figure_key(func.__name__, arguments, code_key(func.__globals__))
+
+            return os.path.join(figures_dir(version), key + '.json')
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            p = path(*args, **kwargs)
+
+            if os.path.exists(p):
+                return read_figure(p)
+
+            fig = func(*args, **kwargs)
+
+            try:
+                write_figure(fig, p)
+            except OSError:
+                pass
+
+            return fig
+
+        def render(**kwargs):
+            write_figure(func(**kwargs), path(**kwargs))
+
+        wrapper.render = render
+
+        if 'self' not in signature.parameters:
+            REGISTRY[func.__name__] = (render, grid)
+
+        return wrapper
+
+    return decorator
+
+
+def build_figures():
+    """
+    Renders all registered figures for every argument combination of their grid.
+    """
+    import analysis  # registers the figure functions
+
+    for name, (render, grid) in REGISTRY.items():
+        for kwargs in grid:
+            render(**kwargs)
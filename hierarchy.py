@@ -0,0 +1,89 @@
+import os
+
+import numpy as np
+import pandas as pd
+import plotly.figure_factory as ff
+
+import store
+
+
+def hierarchy_path(data_dir=store.DATA_DIR):
+    return os.path.join(data_dir, 'hierarchical_topics.json')
+
+
+def load_hierarchy(path=None):
+    """
+    Reads a merge tree as written by BERTopic.hierarchical_topics
+    (Parent_ID, Child_Left_ID, Child_Right_ID, Distance, ...).
+    """
+    hierarchy = pd.read_json(path or hierarchy_path())
+    return hierarchy.sort_values('Parent_ID').reset_index(drop=True)
+
+
+def linkage_matrix(hierarchy):
+    """
+    Converts the merge tree into a scipy linkage matrix.
+
+    BERTopic numbers the parent created by the i-th merge n_leaves + i, which is the id scipy
+    assigns to the i-th row of the linkage matrix, so the ids can be used as they are.
+    """
+    n_leaves = len(hierarchy) + 1
+
+    if not (hierarchy['Parent_ID'].to_numpy() == np.arange(n_leaves, 2 * n_leaves - 1)).all():
+        raise ValueError('Parent ids of the hierarchy are not consecutive')
+
+    return np.column_stack([
+        hierarchy['Child_Left_ID'],
+        hierarchy['Child_Right_ID'],
+        hierarchy['Distance'],
+        hierarchy['Topics'].map(len)
+    ]).astype(np.float64)
+
+
+def leaf_labels(hierarchy):
+    """
+    :return:
+    Labels of the leaves (topics), in the format used by BERTopic ("<topic>_<keywords>")
+    """
+    n_leaves = len(hierarchy) + 1
+
+    names = {}
+
+    for side in ['Left', 'Right']:
+        for topic, name in zip(hierarchy[f'Child_{side}_ID'], hierarchy[f'Child_{side}_Name']):
+            if topic < n_leaves:
+                names[topic] = f'{topic}_{name}'
+
+    return [names.get(topic, str(topic)) for topic in range(n_leaves)]
+
+
+def plot_hierarchy(hierarchy, orientation='left'):
+    """
+    Dendrogram of the stored merge tree, drawn like BERTopic.visualize_hierarchy
+    without touching the model.
+    """
+    Z = linkage_matrix(hierarchy)
+    labels = leaf_labels(hierarchy)
+
+    fig = ff.create_dendrogram(
+        np.zeros((len(labels), 1)),
+        orientation=orientation,
+        labels=labels,
+        distfun=lambda X: None,
+        linkagefun=lambda d: Z,
+        color_threshold=0.7 * Z[:, 2].max()
+    )
+
+    fig.update_layout(
+        plot_bgcolor='#ECEFF1',
+        template='plotly_white',
+        showlegend=False,
+        hoverlabel=dict(
+            bgcolor='white',
+            font_size=16,
+            font_family='Rockwell'
+        ),
+        height=200 + 15 * len(labels),
+    )
+
+    return fig
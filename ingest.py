@@ -0,0 +1,187 @@
+"""
+Adds new curricula to the corpus with the saved topic model, without refitting it.
+
+    python ingest.py kernlehrplan.json
+
+The file holds the sections of the new curricula with the columns of documents.json (bundesland, stufe, titel,
+text and optionally the annotated tokens doc), as a list of records or in the layout of documents.json.
+
+Only the new sections are segmented, embedded and transformed (see pipeline.py). Their rows are appended to the
+sources, the store and the topic probabilities; the sentences already in the corpus keep their topics. The
+aggregates, topic index, bootstrap replicates and sentence embeddings of the new version are derived from those of
+the previous version and the new rows, so they are not computed again for the whole corpus.
+
+The new sentences are scored with the anchors of duality.py if the corpus was scored with the same anchors and model
+(by `python duality.py`). Otherwise their duality scores are left empty: the shipped scores are on another scale,
+and the means over the scored sentences ignore empty scores.
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+import aggregates
+import artifacts
+import bootstrap
+import curricula
+import duality
+import pipeline
+import sentence_embeddings
+import store
+import topic_index
+
+
+def read_documents(path):
+    documents = pd.read_json(path)
+
+    missing = set(curricula.GROUPS + ['titel', 'text']) - set(documents.columns)
+    if missing:
+        raise ValueError(f'{path} lacks the columns {", ".join(sorted(missing))}')
+
+    return documents
+
+
+def ingest(new_documents, data_dir=store.DATA_DIR, model_dir=artifacts.MODEL_DIR, processes=None, threads=None):
+    """
+    Appends the sections of new curricula to the corpus.
+
+    :param new_documents:
+    DataFrame with the columns of documents.json
+    :return:
+    The new data/model version
+    """
+    store.ensure_store(data_dir)
+    artifacts.ensure_artifacts(model_dir)
+
+    # Scores of other anchors are on another scale, so the means over old and new sentences would be meaningless
+    scored = duality.scored_anchors(data_dir) == duality.anchors_key(model_dir)
+
+    documents = pd.read_json(store.source_path('documents', data_dir))
+    sentences = pd.read_json(store.source_path('sentences', data_dir))
+    scores = pd.read_json(store.source_path('duality', data_dir))
+
+    # The sentences of a curriculum must stay contiguous (see curricula.render_curricula)
+    existing = set(documents[curricula.GROUPS].itertuples(index=False, name=None))
+    added = set(new_documents[curricula.GROUPS].itertuples(index=False, name=None))
+
+    if existing & added:
+        raise ValueError(
+            f'The corpus already contains the curricula {sorted(existing & added)}; '
+            'change documents.json and run pipeline.py to replace them'
+        )
+
+    # Sorted, so the sections of each new curriculum are consecutive
+    new_documents = new_documents.sort_values(curricula.GROUPS, kind='stable')
+    new_documents.index = np.arange(len(new_documents)) + documents.index.max() + 1
+
+    results = pipeline.Pipeline(data_dir, model_dir, processes, threads).process(
+        new_documents.to_dict('records'), until='duality' if scored else 'topics'
+    )
+
+    new_sentences = pipeline.sentences_frame(new_documents.index, results['clean'])
+    if not len(new_sentences):
+        raise ValueError('The new sections contain no phrases')
+
+    embeddings = np.concatenate([e['embeddings'] for e in results['embed'] if len(e['embeddings'])])
+    topics = [t for t in results['topics'] if len(t['topics'])]
+
+    print(f'Adding {len(new_documents)} sections with {len(new_sentences)} sentences')
+
+    old_version = store.version(data_dir, model_dir)
+    n_sentences = len(sentences)
+
+    # The new sentences go to the end of the corpus, so the existing rows keep their positions
+    pd.concat([documents, new_documents.reindex(columns=documents.columns)]).to_json(
+        store.source_path('documents', data_dir)
+    )
+    pd.concat([sentences, new_sentences], ignore_index=True).to_json(store.source_path('sentences', data_dir))
+
+    if scored:
+        duality.write_scores(
+            pd.concat([scores, pipeline.duality_frame(results['duality'])], ignore_index=True), data_dir, model_dir
+        )
+    else:
+        scores.reset_index(drop=True).reindex(np.arange(len(scores) + len(new_sentences))).to_json(
+            store.source_path('duality', data_dir)
+        )
+
+    model = artifacts.ModelArtifacts(model_dir)
+
+    artifacts.write_artifacts(
+        np.concatenate([model.probabilities_] + [t['probabilities'] for t in topics]),
+        np.concatenate([model.topics_] + [t['topics'] for t in topics]),
+        model.get_topic_info(),
+        model.topic_ids,
+        model.topic_embeddings_,
+        model_dir
+    )
+
+    store.build_store(data_dir)
+    version = store.version(data_dir, model_dir)
+
+    extend_derived(old_version, version, n_sentences, embeddings, data_dir, model_dir)
+
+    return version
+
+
+def extend_derived(old_version, version, offset, embeddings, data_dir=store.DATA_DIR, model_dir=artifacts.MODEL_DIR):
+    """
+    Derives the results of the new version from those of the old version that exist, for the sentences from
+    offset on. Results that do not exist yet are built lazily from the whole corpus, as usual.
+    """
+    documents, df, duality = store.load_store(data_dir)
+    model = artifacts.ModelArtifacts(model_dir)
+
+    props = aggregates.topic_props(df, model, rows=slice(offset, None))
+    cube = None
+
+    if os.path.exists(store.table_path(aggregates.cube_name(old_version), data_dir)):
+        old_cube = aggregates.TopicCube.from_frame(
+            store.load_table(aggregates.cube_name(old_version), data_dir=data_dir)
+        )
+        cube = old_cube.combine(aggregates.TopicCube.from_props(props))
+        store.write_table(cube.to_frame(), aggregates.cube_name(version), data_dir)
+
+    # The replicates follow the rows of the cube of their version
+    if cube is not None and os.path.exists(store.array_path(bootstrap.bootstrap_name(old_version), data_dir)):
+        bootstrap.extend_bootstrap(
+            old_version, version, model.probabilities_, old_cube.curricula, cube, store.load_curricula(data_dir),
+            data_dir=data_dir
+        )
+
+    order_name, probabilities_name = topic_index.index_names(old_version)
+
+    if os.path.exists(store.array_path(order_name, data_dir)):
+        props = props.drop(aggregates.GROUPS, axis=1)
+        index = topic_index.TopicIndex(
+            props.columns,
+            store.read_array(order_name, data_dir),
+            store.read_array(probabilities_name, data_dir)
+        ).extend(props, offset)
+
+        order_name, probabilities_name = topic_index.index_names(version)
+        store.write_array(index.order, order_name, data_dir)
+        store.write_array(index.probabilities, probabilities_name, data_dir)
+
+    if sentence_embeddings.load_sentence_embeddings(old_version, data_dir) is not None:
+        store.extend_array(
+            sentence_embeddings.embeddings_name(old_version),
+            sentence_embeddings.embeddings_name(version),
+            sentence_embeddings.normalize(embeddings),
+            data_dir
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', help='JSON file with the sections of the new curricula')
+    parser.add_argument('--processes', type=int, help='embedding processes (default: one per core)')
+    parser.add_argument('--threads', type=int, help='torch threads per embedding process (default: cores / processes)')
+    args = parser.parse_args()
+
+    print(f'Version {ingest(read_documents(args.path), processes=args.processes, threads=args.threads)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,309 @@
+"""
+Load test: simulates concurrent dashboard sessions and reports the latency per interaction.
+
+    python loadtest.py [--sessions 10] [--interactions 20] [--think 1.0]           # analysis layer
+    python loadtest.py --target api --url http://127.0.0.1:8000                    # running api.py
+
+Every session opens the dashboard and then follows a random interaction script: moving the threshold
+slider, choosing another topic, level, curriculum or cluster of duplicates, toggling the state/level filter and
+entering search queries, with exponentially distributed think times in between.
+
+The analysis target runs the sessions as threads of this process, like Streamlit runs the sessions of
+one replica, and executes the complete rerun of Dashboard.py for every interaction: the functions of
+analysis.py that Dashboard.py calls, the serialization of figures and tables and the data of the download
+buttons. The api target sends the requests of each interaction to api.py.
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+import numpy as np
+import pandas as pd
+import plotly.io as pio
+import pyarrow as pa
+
+INTERACTIONS = {
+    'threshold': 3,
+    'topic': 3,
+    'curriculum': 2,
+    'search': 2,
+    'level': 1,
+    'filter': 1,
+    'cluster': 1,
+}
+
+LEVEL_OPTIONS = ['Sekundarstufe I', 'Sekundarstufe II', 'Sekundarstufe I & II']
+
+THRESHOLDS = [round(0.5 + 0.05 * i, 2) for i in range(11)]
+
+SEARCH_TERMS = [
+    'Künstliche Intelligenz', 'Datenbanken', 'Sortieralgorithmen', 'Verschlüsselung', 'Roboter programmieren',
+    'Datenschutz', 'Objektorientierung', 'Endliche Automaten', 'Netzwerke', 'Rekursion', 'Simulation',
+    'Projektarbeit', 'Binärzahlen', 'Suchmaschinen', 'Komplexität von Algorithmen'
+]
+
+
+class AnalysisTarget:
+    """
+    Executes the reruns of Dashboard.py on the analysis module of this process, as the dashboard does.
+    """
+
+    def __init__(self, stand_in=False):
+        import analysis
+
+        self.analysis = analysis
+
+        if stand_in:
+            from bench import StandInModel
+            analysis._topic_model = StandInModel(dimensions=analysis.model.topic_embeddings_.shape[1])
+
+        self.topics = analysis.df_topics['Thema'].tolist()
+        self.curricula = sorted(analysis.curricula.ranges)
+        self.clusters = analysis.get_duplicate_clusters().index.tolist()
+
+    def run(self, kind, state):
+        a = self.analysis
+        curriculum_state, curriculum_level = state['curriculum']
+        filter_state, filter_level = state['filter'] or (None, None)
+
+        a.n_states(), a.n_curricula(), a.n_sentences()
+
+        figures = [
+            a.get_total_topic_dist(),
+            a.plot_topic_similarity(),
+            a.plot_level(),
+            a.plot_level_barpolar(),
+            a.plot_states(level=state['level']),
+            a.plot_curriculum_similarity(),
+            a.plot_cooccurrence(),
+            a.plot_duality(),
+        ]
+
+        frames = [
+            a.df_topics,
+            a.get_topic(state['topic'], state['threshold'], state=filter_state, level=filter_level),
+            a.get_duplicate_clusters(),
+        ]
+
+        if state['search']:
+            frames += [a.search_for(search_term=state['search']), a.search_sentences(search_term=state['search'])]
+
+        if state['cluster'] is not None:
+            frames.append(a.get_duplicate_cluster(state['cluster']))
+
+        curriculum = a.get_curriculum_text(state=curriculum_state, level=curriculum_level)
+
+        # The data of the download buttons
+        a.df_topics.to_json().encode('utf-8')
+        a.get_duplicates_csv()
+
+        # What Streamlit sends to the browser
+        for fig in figures:
+            pio.to_json(fig, validate=False)
+
+        for df in frames:
+            if df is not None:
+                pa.Table.from_pandas(df)
+
+        json.dumps(curriculum)
+
+
+class ApiTarget:
+    """
+    Sends the requests of an interaction to api.py.
+    """
+
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+
+        self.topics = [topic['Thema'] for topic in self.get('/topics')]
+
+        self.curricula = sorted({(c['bundesland'], c['stufe']) for c in self.get('/curricula')})
+
+        self.clusters = sorted({d['cluster'] for d in self.get('/duplicates')})
+
+    def get(self, path, **params):
+        params = {key: value for key, value in params.items() if value is not None}
+        url = self.url + urllib.parse.quote(path) + ('?' + urllib.parse.urlencode(params) if params else '')
+
+        with urllib.request.urlopen(url) as response:
+            return json.loads(response.read())
+
+    def run(self, kind, state):
+        filter_state, filter_level = state['filter'] or (None, None)
+
+        if kind in ['open', 'level']:
+            self.get('/aggregates')
+
+        if kind in ['open', 'topic', 'threshold', 'filter']:
+            self.get(f'/topics/{state["topic"]}/sentences', threshold=state['threshold'],
+                     state=filter_state, level=filter_level)
+
+        if kind in ['open', 'curriculum']:
+            self.get('/curricula/{}/{}'.format(*state['curriculum']))
+
+        if kind in ['open', 'search'] and state['search']:
+            self.get('/search/topics', q=state['search'])
+            self.get('/search/sentences', q=state['search'])
+
+        if kind == 'open':
+            self.get('/duplicates')
+
+        if kind in ['open', 'cluster'] and state['cluster'] is not None:
+            self.get('/duplicates', cluster=state['cluster'])
+
+
+def initial_state(target):
+    """
+    Widget values of a new session, as set by the defaults of Dashboard.py
+    """
+    return {
+        'level': LEVEL_OPTIONS[0],
+        'topic': target.topics[0],
+        'threshold': 0.8,
+        'filter': None,
+        'curriculum': target.curricula[0],
+        'search': None,
+        'cluster': target.clusters[0] if target.clusters else None,
+    }
+
+
+def interact(kind, state, target, rng):
+    """
+    Changes the widget of the interaction.
+    """
+    if kind == 'threshold':
+        state['threshold'] = rng.choice(THRESHOLDS)
+    elif kind == 'topic':
+        state['topic'] = rng.choice(target.topics)
+    elif kind == 'curriculum':
+        # Only the (state, level) pairs of existing curricula, as not every state has a curriculum for every level
+        state['curriculum'] = rng.choice(target.curricula)
+    elif kind == 'search':
+        # Combined terms make some of the queries new to the embedding cache
+        terms = rng.sample(SEARCH_TERMS, rng.choice([1, 1, 2]))
+        state['search'] = ' '.join(terms)
+    elif kind == 'level':
+        state['level'] = rng.choice(LEVEL_OPTIONS)
+    elif kind == 'filter':
+        state['filter'] = None if state['filter'] else rng.choice(target.curricula)
+    elif kind == 'cluster' and target.clusters:
+        state['cluster'] = rng.choice(target.clusters)
+
+
+def session(target, n_interactions, think, rng, records):
+    state = initial_state(target)
+    kinds, weights = zip(*INTERACTIONS.items())
+
+    for i in range(n_interactions + 1):
+        if i == 0:
+            kind = 'open'
+        else:
+            time.sleep(rng.expovariate(1 / think) if think > 0 else 0)
+            kind = rng.choices(kinds, weights)[0]
+            interact(kind, state, target, rng)
+
+        start = time.perf_counter()
+
+        try:
+            target.run(kind, state)
+            error = None
+        except Exception as e:
+            error = f'{type(e).__name__}: {str(e).splitlines()[0] if str(e) else ""}'
+
+        records.append((kind, time.perf_counter() - start, error))
+
+
+def run(target, sessions, n_interactions, think, seed=0):
+    """
+    :return:
+    List of (interaction, latency in seconds, error) and the wall time of the test
+    """
+    records = []
+
+    threads = [
+        threading.Thread(target=session, args=(target, n_interactions, think, random.Random(seed + i), records))
+        for i in range(sessions)
+    ]
+
+    start = time.perf_counter()
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    return records, time.perf_counter() - start
+
+
+def report(records, duration):
+    """
+    :return:
+    DataFrame with the count, errors, latency percentiles (ms) and throughput (1/s) per interaction
+    """
+    df = pd.DataFrame(records, columns=['interaction', 'latency', 'error'])
+
+    def summarize(group):
+        latency = group['latency'].to_numpy() * 1000
+        return pd.Series({
+            'count': len(group),
+            'errors': int(group['error'].notna().sum()),
+            'p50_ms': np.percentile(latency, 50),
+            'p95_ms': np.percentile(latency, 95),
+            'p99_ms': np.percentile(latency, 99),
+            'mean_ms': latency.mean(),
+            'per_s': len(group) / duration
+        })
+
+    rows = {interaction: summarize(group) for interaction, group in df.groupby('interaction')}
+    rows['all'] = summarize(df)
+
+    return pd.DataFrame(rows).T.astype({'count': int, 'errors': int})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--target', choices=['analysis', 'api'], default='analysis')
+    parser.add_argument('--url', default='http://127.0.0.1:8000', help='URL of api.py (api target)')
+    parser.add_argument('--sessions', type=int, default=10, help='number of concurrent sessions')
+    parser.add_argument('--interactions', type=int, default=20, help='interactions per session after opening')
+    parser.add_argument('--think', type=float, default=1.0, help='mean think time between interactions in seconds')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--stand-in', action='store_true',
+                        help='embed search queries with a random stand-in instead of the topic model (analysis target)')
+    parser.add_argument('--output', help='write the records and the report to this JSON file')
+    args = parser.parse_args()
+
+    target = ApiTarget(args.url) if args.target == 'api' else AnalysisTarget(args.stand_in)
+
+    records, duration = run(target, args.sessions, args.interactions, args.think, args.seed)
+    df = report(records, duration)
+
+    print(df.to_string(float_format='{:.1f}'.format))
+    print(f'{len(records)} interactions of {args.sessions} sessions in {duration:.1f} s', file=sys.stderr)
+
+    errors = [error for _, _, error in records if error is not None]
+    if errors:
+        print(f'{len(errors)} errors, e.g. {errors[0]}', file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'target': args.target,
+                'sessions': args.sessions,
+                'interactions': args.interactions,
+                'think': args.think,
+                'duration_s': duration,
+                'report': df.reset_index(names='interaction').to_dict('records'),
+                'records': records
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,339 @@
+"""
+Reproducible pipeline from the section texts (documents.json) to the phrases, topics and duality scores.
+
+    python pipeline.py                  # all stages, written to data/pipeline/output
+    python pipeline.py --until clean    # only segmentation and cleaning
+    python pipeline.py --replace        # all stages, replacing the phrases, topics and scores of the corpus
+
+The stages segment → clean → embed → topics → duality run per document. Their results are cached in
+data/pipeline under the content hash of their input, so a run only processes the documents that changed since
+the last run (e.g. the curricula of one state) and takes everything else from the cache.
+
+Writes sentences.json, duality.json and artifacts/ of the stages that ran to the output directory. The shipped
+sources stay untouched: the segmentation approximates the one the corpus was built with, topics and probabilities
+come from the transform of the saved topic model instead of its fit, and the duality scores from the anchors in
+duality.py. Only --replace writes data/sentences.json, data/duality.json and model/artifacts, and only for a run of
+all stages, together with a rebuild of the store, so phrases, probabilities and scores always match.
+"""
+import argparse
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+import artifacts
+import duality
+import segmentation
+import sentence_embeddings
+import store
+
+STAGES = ['segment', 'clean', 'embed', 'topics', 'duality']
+
+# Bumped when the output of a stage changes, so its cached results are computed again
+STAGE_VERSIONS = {
+    'segment': 1,
+    'clean': 1,
+    'embed': 1,
+    'topics': 1,
+    'duality': 1,
+}
+
+
+def pipeline_dir(data_dir=store.DATA_DIR):
+    return os.path.join(data_dir, 'pipeline')
+
+
+def output_dir(data_dir=store.DATA_DIR):
+    return os.path.join(pipeline_dir(data_dir), 'output')
+
+
+def digest(*parts):
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, ensure_ascii=False).encode()).hexdigest()[:24]
+
+
+def segment_document(document):
+    return pd.DataFrame(
+        list(enumerate(segmentation.segment(document['titel'], document['text']))),
+        columns=['i', 'raw_sentence']
+    )
+
+
+def clean_document(item):
+    document, df = item
+    lemma_map = segmentation.lemmas(document.get('doc'))
+
+    df = df.assign(sentence=[segmentation.clean(raw_sentence, lemma_map) for raw_sentence in df['raw_sentence']])
+    return df[df['sentence'] != ''].reset_index(drop=True)
+
+
+def sentences_frame(ids, cleaned):
+    """
+    :return:
+    Rows of sentences.json for the cleaned phrases of the documents with the given ids
+    """
+    return pd.concat(
+        [df.assign(document=document) for document, df in zip(ids, cleaned)],
+        ignore_index=True
+    )[['document', 'i', 'sentence', 'raw_sentence']]
+
+
+def duality_frame(scores):
+    return pd.DataFrame(np.concatenate([s['scores'] for s in scores]), columns=duality.COLUMNS)
+
+
+class StageCache:
+    """
+    Results of one stage, one file per document named after the hash of its input.
+    Text results are Arrow tables, numeric results npz archives.
+    """
+
+    def __init__(self, stage, data_dir=store.DATA_DIR):
+        self.dir = os.path.join(pipeline_dir(data_dir), stage)
+        self.used = set()
+
+    def path(self, key):
+        return os.path.join(self.dir, key)
+
+    def __contains__(self, key):
+        self.used.add(key)
+        return os.path.exists(self.path(key))
+
+    def get(self, key):
+        self.used.add(key)
+
+        with open(self.path(key), 'rb') as f:
+            if f.read(6) == b'ARROW1':
+                return feather.read_table(self.path(key)).to_pandas()
+
+        with np.load(self.path(key)) as archive:
+            return {name: archive[name] for name in archive.files}
+
+    def put(self, key, value):
+        os.makedirs(self.dir, exist_ok=True)
+        self.used.add(key)
+
+        tmp = self.path(key) + '.tmp'
+
+        if isinstance(value, pd.DataFrame):
+            feather.write_feather(pa.Table.from_pandas(value, preserve_index=False), tmp, compression='uncompressed')
+        else:
+            with open(tmp, 'wb') as f:
+                np.savez(f, **value)
+
+        os.replace(tmp, self.path(key))
+
+    def prune(self):
+        """
+        Removes the results that were not used by this run.
+        """
+        if not os.path.isdir(self.dir):
+            return 0
+
+        unused = [name for name in os.listdir(self.dir) if name not in self.used]
+
+        for name in unused:
+            os.remove(self.path(name))
+
+        return len(unused)
+
+
+class Pipeline:
+
+    def __init__(self, data_dir=store.DATA_DIR, model_dir=artifacts.MODEL_DIR, processes=None, threads=None):
+        self.data_dir = data_dir
+        self.model_dir = model_dir
+        self.processes = processes
+        self.threads = threads
+        self.caches = {stage: StageCache(stage, data_dir) for stage in STAGES}
+
+        self._topic_model = None
+
+    @property
+    def topic_model(self):
+        if self._topic_model is None:
+            self._topic_model = artifacts.load_topic_model(self.model_dir)
+
+        return self._topic_model
+
+    def embed_texts(self, texts):
+        return sentence_embeddings.encode(self.topic_model, texts, self.processes, self.threads)
+
+    # Stages: each computes the results for a batch of documents
+
+    def segment(self, documents):
+        return list(segmentation.imap(segment_document, documents, self.processes))
+
+    def clean(self, documents, segmented):
+        return list(segmentation.imap(clean_document, zip(documents, segmented), self.processes))
+
+    def embed(self, cleaned):
+        # One call for all changed documents, so the embedding model can batch across them
+        sentences = [sentence for df in cleaned for sentence in df['sentence']]
+        embeddings = self.embed_texts(sentences) if sentences else np.empty((0, 0), dtype=np.float32)
+
+        bounds = np.cumsum([len(df) for df in cleaned])[:-1]
+        return [{'embeddings': part} for part in np.split(embeddings, bounds)]
+
+    def topics(self, cleaned, embedded):
+        sentences = [sentence for df in cleaned for sentence in df['sentence']]
+
+        if not sentences:
+            return [{'topics': np.empty(0, dtype=np.int64), 'probabilities': np.empty((0, 0))} for _ in cleaned]
+
+        embeddings = np.concatenate([e['embeddings'] for e in embedded if len(e['embeddings'])])
+        topics, probabilities = self.topic_model.transform(sentences, embeddings)
+
+        probabilities = np.asarray(probabilities)
+        if probabilities.ndim != 2:
+            raise ValueError('The topic model does not compute topic probabilities (calculate_probabilities=False)')
+
+        bounds = np.cumsum([len(df) for df in cleaned])[:-1]
+
+        return [
+            {'topics': t, 'probabilities': p}
+            for t, p in zip(np.split(np.asarray(topics, dtype=np.int64), bounds), np.split(probabilities, bounds))
+        ]
+
+    def duality(self, embedded):
+        anchors = duality.load_anchors(self.embed_texts, self.model_dir)
+        return [{'scores': duality.score_chunks(e['embeddings'], anchors)} for e in embedded]
+
+    def stage(self, name, keys, compute, *inputs):
+        """
+        Returns the results of a stage for all documents, computing only those that are not cached.
+        """
+        cache = self.caches[name]
+        missing = [n for n, key in enumerate(keys) if key not in cache]
+
+        print(f'{name}: {len(missing)} of {len(keys)} documents')
+
+        results = [None] * len(keys)
+
+        if missing:
+            computed = compute(*[[values[n] for n in missing] for values in inputs])
+
+            for n, result in zip(missing, computed):
+                cache.put(keys[n], result)
+                results[n] = result
+
+        for n, key in enumerate(keys):
+            if results[n] is None:
+                results[n] = cache.get(key)
+
+        return results
+
+    def process(self, records, until='duality'):
+        """
+        Runs the stages up to until for the given documents.
+
+        :return:
+        dict stage → list of the results per document
+        """
+        stages = STAGES[:STAGES.index(until) + 1]
+        keys = {'document': [digest(record) for record in records]}
+        results = {}
+
+        def stage_keys(name, upstream, *extra):
+            return [digest(name, STAGE_VERSIONS[name], key, *extra) for key in keys[upstream]]
+
+        keys['segment'] = stage_keys('segment', 'document')
+        results['segment'] = self.stage('segment', keys['segment'], self.segment, records)
+
+        if 'clean' in stages:
+            keys['clean'] = stage_keys('clean', 'segment')
+            results['clean'] = self.stage('clean', keys['clean'], self.clean, records, results['segment'])
+
+        if 'embed' in stages:
+            model = artifacts.model_fingerprint(self.model_dir)
+
+            keys['embed'] = stage_keys('embed', 'clean', model)
+            results['embed'] = self.stage('embed', keys['embed'], self.embed, results['clean'])
+
+        if 'topics' in stages:
+            keys['topics'] = stage_keys('topics', 'embed', model)
+            results['topics'] = self.stage('topics', keys['topics'], self.topics, results['clean'], results['embed'])
+
+        if 'duality' in stages:
+            keys['duality'] = stage_keys('duality', 'embed', digest(duality.ANCHORS))
+            results['duality'] = self.stage('duality', keys['duality'], self.duality, results['embed'])
+
+        return results
+
+    def run(self, until='duality', prune=False, output=None, replace=False):
+        """
+        Writes the results of the stages up to until to output (output_dir() by default) or, with replace, replaces
+        the sources and artifacts of the corpus with them and rebuilds the store.
+        """
+        if replace and until != STAGES[-1]:
+            raise ValueError('Only a run of all stages can replace the phrases, topics and scores of the corpus')
+
+        data_dir = model_dir = output or output_dir(self.data_dir)
+        if replace:
+            data_dir, model_dir = self.data_dir, self.model_dir
+
+        documents = pd.read_json(store.source_path('documents', self.data_dir))
+        results = self.process(documents.to_dict('records'), until)
+
+        os.makedirs(data_dir, exist_ok=True)
+
+        if 'clean' in results:
+            sentences_frame(documents.index, results['clean']).to_json(store.source_path('sentences', data_dir))
+
+        if 'topics' in results:
+            self.write_artifacts(results['topics'], model_dir)
+
+        if 'duality' in results:
+            duality.write_scores(duality_frame(results['duality']), data_dir, self.model_dir)
+
+        if replace:
+            store.build_store(self.data_dir)
+        else:
+            print(f'Written to {data_dir}')
+
+        if prune:
+            for name in results:
+                print(f'{name}: removed {self.caches[name].prune()} unused results')
+
+    def write_artifacts(self, topics, model_dir):
+        # The topic table and embeddings do not depend on the documents; without a loaded model they are taken
+        # from the existing artifacts.
+        if self._topic_model is None and os.path.exists(artifacts.artifact_path('manifest.json', self.model_dir)):
+            model = artifacts.ModelArtifacts(self.model_dir)
+            topic_ids = np.array(model.topic_ids)
+        else:
+            model = self.topic_model
+            topic_ids = sorted(model.topic_representations_.keys())
+
+        artifacts.write_artifacts(
+            np.concatenate([t['probabilities'] for t in topics if len(t['topics'])]),
+            np.concatenate([t['topics'] for t in topics]),
+            model.get_topic_info(),
+            topic_ids,
+            np.array(model.topic_embeddings_),
+            model_dir
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--until', choices=STAGES, default=STAGES[-1], help='last stage to run')
+    parser.add_argument('--prune', action='store_true', help='remove cached results that were not used')
+    parser.add_argument('--output', help='directory of the results (default: data/pipeline/output)')
+    parser.add_argument('--replace', action='store_true',
+                        help='replace the phrases, topics and duality scores of the corpus and rebuild the store')
+    parser.add_argument('--processes', type=int, help='embedding processes (default: one per core)')
+    parser.add_argument('--threads', type=int, help='torch threads per embedding process (default: cores / processes)')
+    args = parser.parse_args()
+
+    if args.replace and (args.until != STAGES[-1] or args.output):
+        parser.error('--replace needs a run of all stages and no --output')
+
+    Pipeline(processes=args.processes, threads=args.threads).run(args.until, args.prune, args.output, args.replace)
+
+
+if __name__ == '__main__':
+    main()
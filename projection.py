@@ -0,0 +1,131 @@
+import os
+
+import numpy as np
+import plotly.graph_objects as go
+
+import aggregates
+import artifacts
+import sentence_embeddings
+import store
+
+MAX_POINTS = 20_000
+
+OUTLIER_COLOR = 'rgb(207, 212, 218)'
+
+
+def projection_name(version):
+    return f'projection-{version}'
+
+
+def compute_projection(embeddings):
+    """
+    Reduces the sentence embeddings to 2-D with the same UMAP settings as BERTopic.visualize_documents.
+    """
+    from umap import UMAP
+
+    umap = UMAP(n_neighbors=10, n_components=2, min_dist=0.0, metric='cosine', random_state=42)
+    return umap.fit_transform(np.asarray(embeddings, dtype=np.float32)).astype(np.float32)
+
+
+def load_projection(version, compute, data_dir=store.DATA_DIR):
+    """
+    Loads the 2-D coordinates for the given data/model version and computes them with compute() if
+    they do not exist yet.
+    """
+    name = projection_name(version)
+
+    if not os.path.exists(store.array_path(name, data_dir)):
+        store.write_array(compute(), name, data_dir)
+
+    return store.read_array(name, data_dir)
+
+
+def build_projection(data_dir=store.DATA_DIR, model_dir=artifacts.MODEL_DIR):
+    version = store.version(data_dir, model_dir)
+    embeddings = sentence_embeddings.load_sentence_embeddings(version, data_dir)
+
+    store.write_array(compute_projection(embeddings), projection_name(version), data_dir)
+
+
+def downsample(xy, max_points=MAX_POINTS, bins=200, seed=0):
+    """
+    Density-aware downsampling: the plane is divided into bins × bins cells and every cell keeps at
+    most the same number of points. Dense clusters are thinned while sparse regions stay complete.
+
+    :return:
+    Sorted ids of the points to keep
+    """
+    n = len(xy)
+
+    if n <= max_points:
+        return np.arange(n)
+
+    lower = xy.min(axis=0)
+    extent = np.maximum(xy.max(axis=0) - lower, 1e-12)
+    cells = np.minimum(((xy - lower) / extent * bins).astype(np.int64), bins - 1)
+    cells = cells[:, 0] * bins + cells[:, 1]
+
+    # Random rank of every point within its cell
+    permutation = np.random.default_rng(seed).permutation(n)
+    order = permutation[np.argsort(cells[permutation], kind='stable')]
+    sorted_cells = cells[order]
+    first = np.searchsorted(sorted_cells, sorted_cells, side='left')
+    rank = np.empty(n, dtype=np.int64)
+    rank[order] = np.arange(n) - first
+
+    # Largest per-cell capacity that keeps the total below max_points
+    counts = np.bincount(cells)
+    counts = counts[counts > 0]
+    low, high = 1, counts.max()
+    while low < high:
+        capacity = (low + high + 1) // 2
+        if np.minimum(counts, capacity).sum() <= max_points:
+            low = capacity
+        else:
+            high = capacity - 1
+
+    return np.flatnonzero(rank < low)
+
+
+def plot_projection(xy, topics, names, texts, max_points=MAX_POINTS):
+    """
+    Scatter plot of the sentences (one WebGL trace per topic).
+
+    :param names:
+    dict topic → name; topics without a name are drawn in grey
+    """
+    ids = downsample(xy, max_points)
+
+    xy = xy[ids]
+    topics = np.asarray(topics)[ids]
+    texts = np.asarray(texts, dtype=object)[ids]
+
+    fig = go.Figure()
+
+    for topic in np.unique(topics):
+        selection = topics == topic
+        name = names.get(topic)
+
+        fig.add_trace(
+            go.Scattergl(
+                x=xy[selection, 0],
+                y=xy[selection, 1],
+                mode='markers',
+                name=name if name is not None else aggregates.OTHER_LABEL,
+                hovertext=texts[selection],
+                hoverinfo='text',
+                marker=dict(
+                    size=5,
+                    opacity=0.5 if name is not None else 0.3,
+                    color=None if name is not None else OUTLIER_COLOR
+                ),
+                showlegend=name is not None
+            )
+        )
+
+    fig.update_layout(
+        xaxis=dict(visible=False),
+        yaxis=dict(visible=False),
+    )
+
+    return fig
@@ -0,0 +1,77 @@
+import numpy as np
+
+import sentence_embeddings
+import store
+
+BLOCK_SIZE = 1 << 16
+
+
+class SentenceIndex:
+    """
+    Exact nearest-neighbour search over the normalized sentence embeddings (cosine similarity).
+
+    The embeddings are the memory-mapped, normalized float16 sentence embeddings. A query is processed
+    block by block, each block converted to float32 before it is multiplied, so memory stays bounded.
+    Filters are pushed down as row ranges, e.g. the ranges of the selected curricula.
+    """
+
+    def __init__(self, embeddings, block_size=BLOCK_SIZE):
+        self.embeddings = embeddings
+        self.block_size = block_size
+
+    def __len__(self):
+        return len(self.embeddings)
+
+    def blocks(self, ranges):
+        for start, stop in ranges:
+            for block in range(start, stop, self.block_size):
+                yield block, min(block + self.block_size, stop)
+
+    def search(self, query, k=10, ranges=None):
+        """
+        :param query:
+        Embedding of the query (need not be normalized)
+        :param ranges:
+        List of (start, stop) row ranges to search in; all rows by default
+        :return:
+        ids and similarities of the k most similar sentences, most similar first
+        """
+        query = sentence_embeddings.normalize(query)
+
+        if ranges is None:
+            ranges = [(0, len(self))]
+
+        ids = np.empty(0, dtype=np.int64)
+        scores = np.empty(0, dtype=np.float32)
+
+        for start, stop in self.blocks(ranges):
+            block = np.asarray(self.embeddings[start:stop], dtype=np.float32) @ query
+
+            if len(block) > k:
+                top = np.argpartition(block, -k)[-k:]
+            else:
+                top = np.arange(len(block))
+
+            ids = np.concatenate([ids, top + start])
+            scores = np.concatenate([scores, block[top]])
+
+            if len(ids) > k:
+                keep = np.argpartition(scores, -k)[-k:]
+                ids, scores = ids[keep], scores[keep]
+
+        order = np.argsort(-scores, kind='stable')
+
+        return ids[order], scores[order]
+
+
+def load_sentence_index(version, compute, data_dir=store.DATA_DIR):
+    """
+    Loads the index over the sentence embeddings of the given data/model version. If they do not exist yet,
+    they are computed and stored by compute().
+    """
+    embeddings = sentence_embeddings.load_sentence_embeddings(version, data_dir)
+
+    if embeddings is None:
+        embeddings = compute()
+
+    return SentenceIndex(embeddings)
@@ -0,0 +1,270 @@
+"""
+Splits the section texts of the curricula into phrases (raw_sentence) and cleans them for the topic model (sentence).
+
+    python segmentation.py data/documents.json sentences.arrow [--processes 4]
+
+The documents are read as a stream (from JSON lines, one section per line, or documents.json), segmented on a pool
+of processes and written in chunks as an Arrow file or JSON lines, so memory does not grow with the corpus.
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import re
+
+import pandas as pd
+import pyarrow as pa
+
+# Line breaks inside words ("Persönlichkeits-\nschutz") and bullets or numbering at the start of a line
+HYPHENATION = re.compile(r'(?<=\w)-\n(?=[a-zäöüß])')
+BULLET = re.compile(r'^[ \t]*(?:[•·▪◦\-–*]|\d{1,2}[.)]|[a-z][)])[ \t]+', re.M)
+
+# Items of the competence lists start on a new line with a capital letter and the previous item ends with an
+# infinitive or a noun ("Probleme der Datensicherheit analysieren\nHistorische und aktuelle Entwicklungen ...").
+# Other line breaks only wrap the text.
+ITEM_START = re.compile(r'^[A-ZÄÖÜ]')
+ITEM_END = re.compile(r'(?:\b[A-ZÄÖÜ]\w*|[a-zäöüß](?:en|ln|rn))\W*$')
+SENTENCE_END = re.compile(r'(?<=[.!?])\s+(?=[A-ZÄÖÜ0-9„"(])')
+
+WHITESPACE = re.compile(r'\s+')
+WORD = re.compile(r'\w+')
+
+MIN_WORDS = 2
+
+# Rows per chunk of the output
+CHUNK_ROWS = 100_000
+
+# Documents per task of a worker
+TASK_SIZE = 16
+
+COLUMNS = ['document', 'i', 'sentence', 'raw_sentence']
+
+# Phrases that occur in nearly every competence and carry no content
+BOILERPLATE = {'schülerin', 'schülerinnen', 'schüler'}
+
+STOPWORDS = {
+    'aber', 'als', 'am', 'an', 'auch', 'auf', 'aus', 'bei', 'bzw', 'da', 'damit', 'das', 'dass', 'dem', 'den',
+    'der', 'des', 'die', 'dies', 'diese', 'diesem', 'diesen', 'dieser', 'dieses', 'durch', 'ein', 'eine',
+    'einem', 'einen', 'einer', 'eines', 'es', 'für', 'hat', 'haben', 'ihm', 'ihn', 'ihnen', 'ihr', 'ihre',
+    'ihrem', 'ihren', 'ihrer', 'im', 'in', 'ins', 'ist', 'je', 'können', 'kann', 'mit', 'nach', 'nicht',
+    'noch', 'ob', 'oder', 'ohne', 'sich', 'sie', 'sind', 'so', 'sowie', 'über', 'um', 'und', 'unter', 'vom',
+    'von', 'vor', 'wenn', 'werden', 'wird', 'z', 'b', 'zu', 'zum', 'zur', 'zwischen'
+}
+
+
+def items(text):
+    """
+    Joins the wrapped lines of the text into paragraphs and list items.
+    """
+    item = []
+
+    for line in text.split('\n'):
+        line = line.strip()
+
+        if item and (not line or (ITEM_START.match(line) and ITEM_END.search(item[-1]))):
+            yield ' '.join(item)
+            item = []
+
+        if line:
+            item.append(line)
+
+    if item:
+        yield ' '.join(item)
+
+
+def segment(titel, text):
+    """
+    :return:
+    Phrases of the section, each ending with a full stop
+    """
+    text = HYPHENATION.sub('', text)
+    text = BULLET.sub('', text)
+
+    phrases = []
+
+    for item in items(f'{titel}\n\n{text}'):
+        for phrase in SENTENCE_END.split(item):
+            phrase = WHITESPACE.sub(' ', phrase).strip(' ,;:')
+
+            if len(WORD.findall(phrase)) < MIN_WORDS:
+                continue
+
+            if phrase[-1] not in '.!?':
+                phrase += '.'
+
+            phrases.append(phrase)
+
+    return phrases
+
+
+def lemmas(doc):
+    """
+    :return:
+    dict token → lemma of the content words of a section, from its annotated tokens (doc in documents.json)
+    """
+    # Sections added without annotated tokens have no doc (null in documents.json)
+    if not isinstance(doc, list) or not doc:
+        return None
+
+    result = {}
+
+    for token in doc:
+        result.setdefault(token['token'], token['lemma'])
+
+    return result
+
+
+def clean(raw_sentence, lemma_map=None):
+    """
+    Reduces a phrase to the lemmas of its content words, as the topic model was trained on.
+    Without annotated tokens, the lowercase words without stopwords are used.
+    """
+    words = WORD.findall(raw_sentence)
+
+    if lemma_map is not None:
+        words = [lemma_map[word] for word in words if word in lemma_map]
+    else:
+        words = [word.lower() for word in words if word.lower() not in STOPWORDS]
+
+    return ' '.join(word for word in words if word not in BOILERPLATE and not word.isdigit())
+
+
+def process_document(item):
+    """
+    :param item:
+    (document, record of documents.json)
+    :return:
+    Rows (document, i, sentence, raw_sentence) of the phrases of the document that are not empty after cleaning
+    """
+    document, record = item
+    lemma_map = lemmas(record.get('doc'))
+
+    rows = []
+
+    for i, raw_sentence in enumerate(segment(record['titel'], record['text'])):
+        sentence = clean(raw_sentence, lemma_map)
+
+        if sentence:
+            rows.append((document, i, sentence, raw_sentence))
+
+    return rows
+
+
+def imap(func, items, processes=None, task_size=TASK_SIZE):
+    """
+    Ordered map of func over items on a pool of processes.
+
+    The items are submitted in windows of a few tasks per process instead of all at once, so a long
+    stream of items is not buffered in memory.
+    """
+    processes = processes or os.cpu_count()
+
+    if processes == 1:
+        yield from map(func, items)
+        return
+
+    items = iter(items)
+    window = processes * task_size * 4
+
+    with multiprocessing.get_context('fork').Pool(processes) as pool:
+        while True:
+            batch = list(itertools.islice(items, window))
+            if not batch:
+                break
+
+            yield from pool.imap(func, batch, chunksize=task_size)
+
+
+def read_documents(path):
+    """
+    :return:
+    Iterator over (document, record). JSON lines are streamed; their documents are numbered by line
+    unless the records carry a document field. Other files are read in the layout of documents.json.
+    """
+    if path.endswith('.jsonl'):
+        with open(path, encoding='utf-8') as f:
+            for n, line in enumerate(f):
+                if line.strip():
+                    record = json.loads(line)
+                    yield record.get('document', n), record
+        return
+
+    documents = pd.read_json(path)
+    for document, record in zip(documents.index, documents.to_dict('records')):
+        yield document, record
+
+
+def segment_documents(documents, processes=None):
+    """
+    :param documents:
+    Iterable of (document, record)
+    :return:
+    Iterator over the rows (document, i, sentence, raw_sentence), in the order of the documents
+    """
+    for rows in imap(process_document, documents, processes):
+        yield from rows
+
+
+def chunks(rows, size=CHUNK_ROWS):
+    rows = iter(rows)
+
+    while True:
+        chunk = list(itertools.islice(rows, size))
+        if not chunk:
+            return
+
+        yield pd.DataFrame(chunk, columns=COLUMNS)
+
+
+def write_sentences(rows, path, chunk_rows=CHUNK_ROWS):
+    """
+    Writes the rows in chunks to an Arrow file or, if path ends with .jsonl, to JSON lines.
+
+    :return:
+    Number of rows
+    """
+    n = 0
+    writer = None
+    tmp = path + '.tmp'
+
+    schema = pa.schema([
+        ('document', pa.int64()),
+        ('i', pa.int64()),
+        ('sentence', pa.string()),
+        ('raw_sentence', pa.string())
+    ])
+
+    with open(tmp, 'wb') as f:
+        if not path.endswith('.jsonl'):
+            writer = pa.ipc.new_file(f, schema)
+
+        for chunk in chunks(rows, chunk_rows):
+            if writer is not None:
+                writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+            else:
+                f.write(chunk.to_json(orient='records', lines=True, force_ascii=False).encode())
+
+            n += len(chunk)
+
+        if writer is not None:
+            writer.close()
+
+    os.replace(tmp, path)
+
+    return n
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('documents', help='documents.json or JSON lines with one section per line')
+    parser.add_argument('output', help='Arrow file, or JSON lines if it ends with .jsonl')
+    parser.add_argument('--processes', type=int, help='worker processes (default: one per core)')
+    args = parser.parse_args()
+
+    n = write_sentences(segment_documents(read_documents(args.documents), args.processes), args.output)
+    print(f'{n} phrases')
+
+
+if __name__ == '__main__':
+    main()
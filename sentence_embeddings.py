@@ -0,0 +1,276 @@
+"""
+Embeds the sentences of the corpus with the embedding model of the topic model on all cores.
+
+    python sentence_embeddings.py                           # one process per core, one torch thread each
+    python sentence_embeddings.py --processes 2 --threads 4
+
+The sentences are sorted by length and embedded in batches, so a batch holds sentences of similar length and
+little padding is computed. The batches are spread over a pool of forked processes that share the loaded model.
+
+Results are normalized and written to a memory-mapped float16 array in the store as they arrive. Every few batches the array is
+flushed and the finished rows are recorded in a checkpoint file, so an interrupted run continues where it stopped.
+Each run writes to its own array and checkpoint, named by its process id, and moves the array into place when it is
+complete; a later run takes over the files of a run whose process has ended.
+"""
+import argparse
+import functools
+import multiprocessing
+import os
+import re
+import threading
+
+import numpy as np
+
+import artifacts
+import store
+
+BATCH_SIZE = 256
+
+# Bumped whenever the stored embeddings change, so outdated arrays are recomputed (2: normalized)
+EMBEDDINGS_FORMAT = 2
+
+# Batches between two checkpoints
+CHECKPOINT_EVERY = 16
+
+
+def embeddings_name(version):
+    return f'sentence-embeddings-f{EMBEDDINGS_FORMAT}-{version}'
+
+
+def normalize(embeddings):
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+    return embeddings / np.where(norms == 0, 1, norms)
+
+
+def run_name(version, pid):
+    return f'{embeddings_name(version)}.{pid}'
+
+
+def checkpoint_name(version, pid):
+    return f'{run_name(version, pid)}.done'
+
+
+def batches(texts, rows, batch_size=BATCH_SIZE):
+    """
+    :return:
+    Lists of row ids of similar length, longest first
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    order = rows[np.argsort([-len(texts[row]) for row in rows], kind='stable')]
+
+    for start in range(0, len(order), batch_size):
+        yield order[start:start + batch_size]
+
+
+# Serializes the runs of embed_sentences in a process
+_lock = threading.Lock()
+
+# Model of a worker process, set by the initializer of the pool
+_topic_model = None
+
+
+def _init_worker(topic_model, threads):
+    global _topic_model
+    _topic_model = topic_model
+
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+
+
+def _worker_embed(batch):
+    return _embed(_topic_model, batch)
+
+
+def _embed(topic_model, batch):
+    rows, texts = batch
+    embeddings = topic_model._extract_embeddings(texts, method='document', verbose=False)
+    return rows, np.asarray(embeddings, dtype=np.float32)
+
+
+def embed_batches(topic_model, texts, rows, processes=None, threads=None, batch_size=BATCH_SIZE):
+    """
+    Embeds texts[rows] in length-sorted batches.
+
+    :param processes:
+    Number of worker processes (default: one per core). With one process, the batches are embedded in this process.
+    :param threads:
+    Torch threads per worker (default: the cores divided by the processes)
+    :return:
+    Iterator over (row ids, float32 embeddings) in the order the batches finish
+    """
+    processes = processes or os.cpu_count()
+    threads = threads or max(1, os.cpu_count() // processes)
+
+    work = ((rows, [texts[row] for row in rows]) for rows in batches(texts, rows, batch_size))
+
+    if processes == 1:
+        yield from map(functools.partial(_embed, topic_model), work)
+    else:
+        # The forked workers inherit the model of the parent instead of unpickling it
+        with multiprocessing.get_context('fork').Pool(processes, _init_worker, (topic_model, threads)) as pool:
+            yield from pool.imap_unordered(_worker_embed, work)
+
+
+def encode(topic_model, texts, processes=None, threads=None, batch_size=BATCH_SIZE):
+    """
+    :return:
+    float32 embeddings of the texts, in memory
+    """
+    result = None
+
+    for rows, embeddings in embed_batches(topic_model, texts, range(len(texts)), processes, threads, batch_size):
+        if result is None:
+            result = np.empty((len(texts), embeddings.shape[1]), dtype=np.float32)
+        result[rows] = embeddings
+
+    return result if result is not None else np.empty((0, 0), dtype=np.float32)
+
+
+def load_sentence_embeddings(version, data_dir=store.DATA_DIR):
+    """
+    :return:
+    Memory-mapped, normalized float16 embeddings of the sentences, or None if they were not computed completely
+    """
+    if not os.path.exists(store.array_path(embeddings_name(version), data_dir)):
+        return None
+
+    return store.read_array(embeddings_name(version), data_dir)
+
+
+def _running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+
+    return True
+
+
+def resume(version, data_dir=store.DATA_DIR):
+    """
+    Takes over the array and checkpoint of an interrupted run, whose process has ended (or is this process).
+
+    :return:
+    True if the files of an interrupted run now belong to this process
+    """
+    pattern = re.compile(re.escape(embeddings_name(version)) + r'\.(\d+)\.done\.npy')
+    pid = os.getpid()
+
+    for file in os.listdir(store.store_dir(data_dir)):
+        match = pattern.fullmatch(file)
+        if match is None or (int(match.group(1)) != pid and _running(int(match.group(1)))):
+            continue
+
+        other = int(match.group(1))
+
+        try:
+            # Renaming is atomic, so of several processes only one takes over the run
+            os.replace(store.array_path(checkpoint_name(version, other), data_dir),
+                       store.array_path(checkpoint_name(version, pid), data_dir))
+            os.replace(store.array_path(run_name(version, other), data_dir),
+                       store.array_path(run_name(version, pid), data_dir))
+        except FileNotFoundError:
+            continue
+
+        return True
+
+    return False
+
+
+def embed_sentences(texts, version, topic_model, processes=None, threads=None, batch_size=BATCH_SIZE,
+                    data_dir=store.DATA_DIR):
+    """
+    Computes the embeddings of the sentences, continuing from the checkpoint of an interrupted run.
+
+    :return:
+    Memory-mapped, normalized float16 embeddings (len(texts) × dimensions)
+    """
+    with _lock:
+        embeddings = load_sentence_embeddings(version, data_dir)
+        if embeddings is not None:
+            return embeddings
+
+        os.makedirs(store.store_dir(data_dir), exist_ok=True)
+        _embed_sentences(texts, version, topic_model, processes, threads, batch_size, data_dir)
+
+        return store.read_array(embeddings_name(version), data_dir)
+
+
+def _embed_sentences(texts, version, topic_model, processes, threads, batch_size, data_dir):
+    path = store.array_path(run_name(version, os.getpid()), data_dir)
+    checkpoint = store.array_path(checkpoint_name(version, os.getpid()), data_dir)
+
+    out = None
+    done = None
+
+    if resume(version, data_dir):
+        out = np.load(path, mmap_mode='r+')
+        done = np.load(checkpoint, mmap_mode='r+')
+
+        if len(out) != len(texts) or len(done) != len(texts):
+            out = done = None
+
+    if done is None:
+        done = np.lib.format.open_memmap(checkpoint, mode='w+', dtype=np.uint8, shape=(len(texts),))
+
+    rows = np.flatnonzero(done == 0)
+    print(f'Embedding {len(rows)} of {len(texts)} sentences')
+
+    pending = []
+
+    def save_checkpoint():
+        # The embeddings are flushed first, so the checkpoint never records rows that are not on disk
+        out.flush()
+        for finished in pending:
+            done[finished] = 1
+        done.flush()
+        pending.clear()
+
+    for rows, embeddings in embed_batches(topic_model, texts, rows, processes, threads, batch_size):
+        if out is None:
+            out = np.lib.format.open_memmap(path, mode='w+', dtype=np.float16, shape=(len(texts), embeddings.shape[1]))
+
+        out[rows] = normalize(embeddings)
+        pending.append(rows)
+
+        if len(pending) >= CHECKPOINT_EVERY:
+            save_checkpoint()
+
+    if out is not None:
+        save_checkpoint()
+
+    del out, done
+    os.replace(path, store.array_path(embeddings_name(version), data_dir))
+    os.remove(checkpoint)
+
+
+def build_sentence_embeddings(data_dir=store.DATA_DIR, model_dir=artifacts.MODEL_DIR, processes=None, threads=None):
+    documents, df, duality = store.load_store(data_dir)
+
+    return embed_sentences(
+        df['sentence'].tolist(),
+        store.version(data_dir, model_dir),
+        artifacts.load_topic_model(model_dir),
+        processes,
+        threads,
+        data_dir=data_dir
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--processes', type=int, help='worker processes (default: one per core)')
+    parser.add_argument('--threads', type=int, help='torch threads per worker (default: cores / processes)')
+    args = parser.parse_args()
+
+    build_sentence_embeddings(processes=args.processes, threads=args.threads)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+"""
+Shared-memory data plane for running several dashboard/API processes on one machine.
+
+One loader process publishes the files of the store and the model artifacts (Arrow tables and npy
+arrays) into shared memory segments:
+
+    python shared.py publish [prefix]
+
+Workers started with CURRICULA_SHM=<prefix> attach to these segments and read all tables and arrays
+from them without copying, so the data is held in memory once, however many workers run.
+Without CURRICULA_SHM (or if nothing is published under the prefix) the files are memory-mapped.
+"""
+import argparse
+import glob
+import hashlib
+import io
+import json
+import os
+import signal
+import threading
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.feather as feather
+
+PREFIX = os.environ.get('CURRICULA_SHM')
+
+# path → memoryview of the attached segments, None until attach() ran
+_segments = None
+_lock = threading.Lock()
+
+
+def key(path):
+    return os.path.realpath(path)
+
+
+def segment_name(prefix, path):
+    return f'{prefix}-{hashlib.sha1(key(path).encode()).hexdigest()[:16]}'
+
+
+def publish(paths, prefix):
+    """
+    Copies the files into shared memory and publishes a manifest segment named prefix.
+
+    :return:
+    List of the created segments; they exist until they are unlinked
+    """
+    segments = []
+    manifest = {}
+
+    for path in paths:
+        size = os.path.getsize(path)
+        shm = SharedMemory(name=segment_name(prefix, path), create=True, size=max(size, 1))
+
+        with open(path, 'rb') as f:
+            f.readinto(shm.buf[:size])
+
+        segments.append(shm)
+        manifest[key(path)] = {'name': shm.name, 'size': size}
+
+    data = json.dumps(manifest).encode()
+    shm = SharedMemory(name=prefix, create=True, size=len(data))
+    shm.buf[:len(data)] = data
+    segments.append(shm)
+
+    return segments
+
+
+def _open(name):
+    """
+    :return:
+    Memoryview of the segment. The mapping stays open as long as views of it exist.
+    """
+    shm = SharedMemory(name=name)
+    # Attached segments are owned by the publisher; keep the resource tracker of this
+    # process from unlinking them when it exits.
+    resource_tracker.unregister(shm._name, 'shared_memory')
+
+    # Take over the mapping, so closing the segment (also on garbage collection) does not fail
+    # while arrays and tables still point into it.
+    mapping, shm._mmap, shm._buf = shm._mmap, None, None
+    shm.close()
+
+    return memoryview(mapping)
+
+
+def attach(prefix=PREFIX):
+    """
+    Attaches to the segments published under prefix. Does nothing if they do not exist.
+    """
+    global _segments
+
+    with _lock:
+        if _segments is not None:
+            return
+
+        _segments = {}
+
+        if prefix is None:
+            return
+
+        try:
+            manifest = json.loads(bytes(_open(prefix)).rstrip(b'\0'))
+        except FileNotFoundError:
+            return
+
+        for path, entry in manifest.items():
+            _segments[path] = _open(entry['name'])[:entry['size']]
+
+
+def buffer(path):
+    """
+    :return:
+    Memoryview of the published copy of the file, or None if it is not published
+    """
+    if _segments is None:
+        attach()
+
+    return _segments.get(key(path))
+
+
+def read_arrow(path, columns=None):
+    """
+    Reads an Arrow IPC file from shared memory or, if it is not published, memory-maps it.
+    """
+    buf = buffer(path)
+
+    if buf is None:
+        return feather.read_table(path, columns=columns, memory_map=True)
+
+    table = pa.ipc.open_file(pa.py_buffer(buf)).read_all()
+
+    return table.select(columns) if columns is not None else table
+
+
+def read_npy(path):
+    """
+    Reads a npy file from shared memory or, if it is not published, memory-maps it.
+    The returned array is read-only.
+    """
+    buf = buffer(path)
+
+    if buf is None:
+        return np.load(path, mmap_mode='r')
+
+    header = io.BytesIO(bytes(buf[:4096]))
+    version = np.lib.format.read_magic(header)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(header)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(header)
+
+    array = np.ndarray(shape, dtype=dtype, buffer=buf, offset=header.tell(), order='F' if fortran_order else 'C')
+    array.flags.writeable = False
+
+    return array
+
+
+def published_files():
+    """
+    :return:
+    Files of the store and the model artifacts
+    """
+    import artifacts
+    import store
+
+    patterns = [
+        os.path.join(store.store_dir(), '*.arrow'),
+        os.path.join(store.store_dir(), '*.npy'),
+        os.path.join(artifacts.artifacts_dir(), '*.arrow'),
+        os.path.join(artifacts.artifacts_dir(), '*.npy'),
+    ]
+
+    return sorted(path for pattern in patterns for path in glob.glob(pattern))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['publish'])
+    parser.add_argument('prefix', nargs='?', default=PREFIX or 'curricula')
+    args = parser.parse_args()
+
+    segments = publish(published_files(), args.prefix)
+
+    size = sum(shm.size for shm in segments)
+    print(f'Published {len(segments) - 1} files ({size / 1e6:.1f} MB) under {args.prefix}, press Ctrl+C to stop')
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    stop.wait()
+
+    for shm in segments:
+        shm.close()
+        shm.unlink()
+
+
+if __name__ == '__main__':
+    main()
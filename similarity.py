@@ -0,0 +1,143 @@
+import os
+
+import numpy as np
+import plotly.graph_objects as go
+
+import store
+
+# Distances between the curricula, of their topic distributions (cube means) or their sentence embeddings
+METRICS = {
+    'cosine': 'Themenverteilung (Kosinus-Distanz)',
+    'jensenshannon': 'Themenverteilung (Jensen-Shannon-Distanz)',
+    'centroid': 'Embeddings (Kosinus-Distanz der Zentroide)',
+}
+
+# Elements of the intermediate array of the Jensen-Shannon distances, bounds its memory to 128 MB
+BLOCK_ELEMENTS = 1 << 24
+
+BLOCK_SIZE = 1 << 16
+
+
+def distances_name(metric, version):
+    return f'curriculum_distances-{metric}-{version}'
+
+
+def normalize(X):
+    X = np.asarray(X, dtype=np.float64)
+    norms = np.linalg.norm(X, axis=1, keepdims=True)
+    return X / np.where(norms == 0, 1, norms)
+
+
+def cosine_distances(X):
+    X = normalize(X)
+    return np.clip(1 - X @ X.T, 0, 2)
+
+
+def entropy(P):
+    return -np.sum(P * np.log(np.where(P > 0, P, 1)), axis=-1)
+
+
+def jensen_shannon_distances(P, block_elements=BLOCK_ELEMENTS):
+    """
+    Jensen-Shannon distances (base 2, between 0 and 1) of all pairs of distributions, using
+    JS(p, q) = H((p + q) / 2) - (H(p) + H(q)) / 2. The mixtures are computed for blocks of rows at once.
+    """
+    P = np.asarray(P, dtype=np.float64)
+    P = P / P.sum(axis=1, keepdims=True)
+
+    H = entropy(P)
+    D = np.empty((len(P), len(P)))
+
+    rows = max(1, block_elements // P.size)
+
+    for start in range(0, len(P), rows):
+        M = (P[start:start + rows, None, :] + P[None, :, :]) / 2
+        D[start:start + rows] = entropy(M) - (H[start:start + rows, None] + H[None, :]) / 2
+
+    return np.sqrt(np.clip(D, 0, None) / np.log(2))
+
+
+def topic_distances(cube, metric):
+    P = cube.mean.to_numpy(dtype=np.float64)
+
+    if metric == 'cosine':
+        return cosine_distances(P)
+    if metric == 'jensenshannon':
+        return jensen_shannon_distances(P)
+
+    raise ValueError(f'Unknown metric {metric}')
+
+
+def centroids(embeddings, ranges, block_size=BLOCK_SIZE):
+    """
+    :param ranges:
+    (start, stop) rows of each curriculum
+    :return:
+    Mean of the normalized sentence embeddings of each curriculum
+    """
+    result = np.zeros((len(ranges), embeddings.shape[1]))
+
+    for i, (start, stop) in enumerate(ranges):
+        for block in range(start, stop, block_size):
+            result[i] += normalize(embeddings[block:min(block + block_size, stop)]).sum(axis=0)
+
+        result[i] /= max(stop - start, 1)
+
+    return result
+
+
+def centroid_distances(embeddings, ranges):
+    return cosine_distances(centroids(embeddings, ranges))
+
+
+def load_distances(metric, version, compute, data_dir=store.DATA_DIR):
+    """
+    Loads the distance matrix for the given metric and data/model version and computes it with compute() if
+    it does not exist yet.
+    """
+    name = distances_name(metric, version)
+
+    if not os.path.exists(store.array_path(name, data_dir)):
+        store.write_array(compute(), name, data_dir)
+
+    return store.read_array(name, data_dir)
+
+
+def cluster_order(D):
+    """
+    :return:
+    Order of the rows by average-linkage clustering, so similar curricula are next to each other
+    """
+    from scipy.cluster.hierarchy import leaves_list, linkage
+    from scipy.spatial.distance import squareform
+
+    if len(D) < 3:
+        return np.arange(len(D))
+
+    D = (D + D.T) / 2
+    np.fill_diagonal(D, 0)
+
+    # The optimal ordering is quadratic in the number of leaves
+    return leaves_list(linkage(squareform(D, checks=False), method='average', optimal_ordering=len(D) <= 1000))
+
+
+def plot_distances(D, labels):
+    """
+    Heatmap of the distance matrix with rows and columns in the order of the clustering.
+    """
+    order = cluster_order(np.array(D))
+    names = [f'{state} ({level})' for state, level in labels]
+    names = [names[i] for i in order]
+
+    z = np.asarray(D)[np.ix_(order, order)]
+
+    return go.Figure(
+        go.Heatmap(
+            z=z,
+            x=names,
+            y=names,
+            colorscale='Viridis',
+            reversescale=True,
+            hovertemplate='%{y}<br>%{x}<br>Distanz: %{z:.3f}<extra></extra>',
+        )
+    )
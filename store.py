@@ -0,0 +1,251 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+import artifacts
+import curricula
+import shared
+
+DATA_DIR = os.environ.get('CURRICULA_DATA', 'data')
+
+SOURCES = ['documents', 'sentences', 'duality']
+
+# Processes that compute a missing derived file inside a dashboard or api session. Sessions run as threads of the
+# server, which must not fork a pool; build.py computes the derived files on all cores.
+SESSION_PROCESSES = 1
+
+# Bumped whenever the layout of the store changes, so outdated stores are rebuilt
+STORE_FORMAT = 3
+
+# Columns of documents.json that are copied onto every sentence row.
+# They are dictionary-encoded, so each row only holds an integer code.
+DOCUMENT_COLUMNS = ['bundesland', 'stufe', 'titel']
+
+
+def store_dir(data_dir=DATA_DIR):
+    return os.path.join(data_dir, 'store')
+
+
+def source_path(name, data_dir=DATA_DIR):
+    return os.path.join(data_dir, f'{name}.json')
+
+
+def table_path(name, data_dir=DATA_DIR):
+    return os.path.join(store_dir(data_dir), f'{name}.arrow')
+
+
+def array_path(name, data_dir=DATA_DIR):
+    return os.path.join(store_dir(data_dir), f'{name}.npy')
+
+
+def manifest_path(data_dir=DATA_DIR):
+    return os.path.join(store_dir(data_dir), 'manifest.json')
+
+
+def source_stats(data_dir=DATA_DIR):
+    """
+    :return:
+    Size and modification time of every source, which are much cheaper to compare than hashes
+    """
+    stats = {}
+
+    for name in SOURCES:
+        stat = os.stat(source_path(name, data_dir))
+        stats[name] = [stat.st_size, stat.st_mtime_ns]
+
+    return stats
+
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def write_table(df, name, data_dir=DATA_DIR):
+    """
+    Writes a DataFrame as an uncompressed Arrow IPC file, which can be memory-mapped when loading.
+    """
+    os.makedirs(store_dir(data_dir), exist_ok=True)
+
+    path = table_path(name, data_dir)
+    tmp = path + '.tmp'
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    feather.write_feather(table, tmp, compression='uncompressed')
+
+    os.replace(tmp, path)
+
+
+def read_table(name, columns=None, data_dir=DATA_DIR):
+    """
+    Memory-maps a table of the store (or reads it from shared memory, see shared.py).
+    The columns reference the mapped pages directly, so several processes reading
+    the same store share them.
+    """
+    return shared.read_arrow(table_path(name, data_dir), columns=columns)
+
+
+def _string_dtype(arrow_type):
+    # Strings stay in the Arrow buffers instead of being copied into Python objects
+    if pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type):
+        return pd.ArrowDtype(arrow_type)
+
+
+def load_table(name, columns=None, data_dir=DATA_DIR):
+    table = read_table(name, columns=columns, data_dir=data_dir)
+    return table.to_pandas(split_blocks=True, types_mapper=_string_dtype)
+
+
+def write_array(array, name, data_dir=DATA_DIR):
+    os.makedirs(store_dir(data_dir), exist_ok=True)
+
+    path = array_path(name, data_dir)
+    tmp = path + '.tmp.npy'
+
+    np.save(tmp, array)
+    os.replace(tmp, path)
+
+
+def extend_array(name, new_name, rows, data_dir=DATA_DIR):
+    """
+    Writes the array new_name as the array name followed by rows, without loading name into memory.
+    """
+    array = read_array(name, data_dir)
+
+    path = array_path(new_name, data_dir)
+    tmp = path + '.tmp.npy'
+
+    out = np.lib.format.open_memmap(tmp, mode='w+', dtype=array.dtype, shape=(len(array) + len(rows),) + array.shape[1:])
+    out[:len(array)] = array
+    out[len(array):] = rows
+    out.flush()
+    del out
+
+    os.replace(tmp, path)
+
+
+def read_array(name, data_dir=DATA_DIR):
+    return shared.read_npy(array_path(name, data_dir))
+
+
+def read_manifest(data_dir=DATA_DIR):
+    with open(manifest_path(data_dir)) as f:
+        return json.load(f)
+
+
+def write_manifest(manifest, data_dir=DATA_DIR):
+    path = manifest_path(data_dir)
+
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    os.replace(path + '.tmp', path)
+
+
+def version(data_dir=DATA_DIR, model_dir=artifacts.MODEL_DIR):
+    """
+    :return:
+    Key identifying the combination of data and model that derived results are computed from
+    """
+    return f"{read_manifest(data_dir)['version']}-{artifacts.read_manifest(model_dir)['version']}"
+
+
+def build_store(data_dir=DATA_DIR):
+    """
+    Converts the JSON sources into the columnar store.
+
+    sentences.arrow already contains the sentence↔document join, so no merge is necessary when loading.
+    The join only carries the categorical DOCUMENT_COLUMNS; the full text stays in documents.arrow.
+    """
+    documents = pd.read_json(source_path('documents', data_dir))
+    sentences = pd.read_json(source_path('sentences', data_dir))
+    duality = pd.read_json(source_path('duality', data_dir))
+
+    for column in DOCUMENT_COLUMNS:
+        documents[column] = documents[column].astype('category')
+
+    df = sentences.copy()
+
+    for column in DOCUMENT_COLUMNS:
+        df[column] = documents[column].reindex(sentences['document']).values
+
+    write_table(documents.rename_axis('document').reset_index(), 'documents', data_dir)
+    write_table(df, 'sentences', data_dir)
+    write_table(duality, 'duality', data_dir)
+    write_table(curricula.render_curricula(df), 'curricula', data_dir)
+
+    stats = source_stats(data_dir)
+    hashes = {name: file_hash(source_path(name, data_dir)) for name in SOURCES}
+
+    manifest = {
+        'format': STORE_FORMAT,
+        'sources': hashes,
+        'stats': stats,
+        'version': hashlib.sha256(json.dumps(hashes, sort_keys=True).encode()).hexdigest()[:16],
+        'n_documents': len(documents),
+        'n_sentences': len(sentences)
+    }
+
+    write_manifest(manifest, data_dir)
+
+    return manifest
+
+
+def ensure_store(data_dir=DATA_DIR):
+    """
+    Builds the store if it does not exist, has an outdated layout or was built from other sources than the current
+    ones. Sources are only hashed if their size or modification time changed.
+    """
+    if not os.path.exists(manifest_path(data_dir)):
+        build_store(data_dir)
+        return
+
+    manifest = read_manifest(data_dir)
+
+    if manifest.get('format') != STORE_FORMAT:
+        build_store(data_dir)
+        return
+
+    stats = source_stats(data_dir)
+
+    if manifest.get('stats') == stats:
+        return
+
+    if any(file_hash(source_path(name, data_dir)) != manifest['sources'].get(name) for name in SOURCES):
+        build_store(data_dir)
+    else:
+        # Touched but unchanged (e.g. by a checkout), so the next check compares the new times again
+        manifest['stats'] = stats
+        write_manifest(manifest, data_dir)
+
+
+def load_store(data_dir=DATA_DIR):
+    """
+    :return:
+    documents (without text and tokens), sentences joined with their documents and the duality scores.
+    bundesland, stufe and titel are categorical in both tables.
+    The rendered curricula are loaded separately with load_curricula.
+    """
+    ensure_store(data_dir)
+
+    documents = load_table('documents', columns=['document'] + DOCUMENT_COLUMNS, data_dir=data_dir)
+    documents = documents.set_index('document')
+    documents.index.name = None
+
+    df = load_table('sentences', data_dir=data_dir)
+    duality = load_table('duality', data_dir=data_dir)
+
+    return documents, df, duality
+
+
+def load_curricula(data_dir=DATA_DIR):
+    ensure_store(data_dir)
+    return curricula.CurriculumIndex(load_table('curricula', data_dir=data_dir))
@@ -0,0 +1,112 @@
+import os
+
+import numpy as np
+
+import aggregates
+import artifacts
+import store
+
+
+class TopicIndex:
+    """
+    Sentence ids of every topic, ordered by probability.
+
+    A threshold query is a binary search in the sorted probabilities of the topic,
+    followed by a slice of the ids, so its cost only depends on the size of the result.
+    """
+
+    def __init__(self, topics, order, probabilities):
+        self.topics = {topic: i for i, topic in enumerate(topics)}
+        self.order = order
+        self.probabilities = probabilities
+
+    @classmethod
+    def from_props(cls, props):
+        """
+        :param props:
+        DataFrame with one probability column per topic
+        """
+        values = props.to_numpy(dtype=np.float64)
+        order = np.argsort(values, axis=0, kind='stable').T.astype(np.int32)
+        probabilities = np.take_along_axis(values.T, order, axis=1)
+
+        return cls(props.columns, np.ascontiguousarray(order), probabilities)
+
+    def extend(self, props, offset):
+        """
+        :param props:
+        Probabilities of new sentences, with the same columns as the index; their ids start at offset
+        :return:
+        Index of the existing and the new sentences. The new sentences are merged into the sorted
+        probabilities, so the existing ones are not sorted again.
+        """
+        values = props.to_numpy(dtype=np.float64)
+
+        order = np.empty((len(self.order), self.order.shape[1] + len(values)), dtype=np.int32)
+        probabilities = np.empty(order.shape, dtype=np.float64)
+
+        for i in range(len(self.order)):
+            new_order = np.argsort(values[:, i], kind='stable')
+            new_probabilities = values[new_order, i]
+
+            # Ties go after the existing sentences, as in a stable sort of all sentences
+            positions = np.searchsorted(self.probabilities[i], new_probabilities, side='right')
+
+            order[i] = np.insert(self.order[i], positions, new_order + offset)
+            probabilities[i] = np.insert(self.probabilities[i], positions, new_probabilities)
+
+        return TopicIndex(list(self.topics), order, probabilities)
+
+    def query(self, topic, threshold, filters=()):
+        """
+        :param filters:
+        Pairs of (codes, code); only sentences i with codes[i] == code are returned
+        :return:
+        Ids of the sentences with a probability above the threshold, in sentence order
+        """
+        i = self.topics[topic]
+
+        start = np.searchsorted(self.probabilities[i], threshold, side='right')
+        ids = self.order[i, start:]
+
+        for codes, code in filters:
+            ids = ids[codes[ids] == code]
+
+        return np.sort(ids)
+
+
+def index_names(version):
+    return f'topic_order-{version}', f'topic_probabilities-{version}'
+
+
+def load_topic_index(props, version, data_dir=store.DATA_DIR):
+    """
+    Loads the index for the given data/model version and builds it from props if it does not exist yet.
+    """
+    order_name, probabilities_name = index_names(version)
+
+    if os.path.exists(store.array_path(order_name, data_dir)):
+        order = store.read_array(order_name, data_dir)
+        probabilities = store.read_array(probabilities_name, data_dir)
+        return TopicIndex(props.columns, order, probabilities)
+
+    index = TopicIndex.from_props(props)
+    store.write_array(index.order, order_name, data_dir)
+    store.write_array(index.probabilities, probabilities_name, data_dir)
+
+    return index
+
+
+def build_topic_index(data_dir=store.DATA_DIR, model_dir=artifacts.MODEL_DIR):
+    documents, df, duality = store.load_store(data_dir)
+    model = artifacts.load_artifacts(model_dir)
+
+    props = aggregates.topic_props(df, model).drop(aggregates.GROUPS, axis=1)
+
+    index = TopicIndex.from_props(props)
+
+    order_name, probabilities_name = index_names(store.version(data_dir, model_dir))
+    store.write_array(index.order, order_name, data_dir)
+    store.write_array(index.probabilities, probabilities_name, data_dir)
+
+    return index
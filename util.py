@@ -1,11 +1,26 @@
 import numpy as np
 import pandas as pd
-from bertopic import BERTopic
-import os
 import plotly.graph_objects as go
+import threading
 from plotly.subplots import make_subplots
-import streamlit as st
 from dataclasses import dataclass
+from functools import cached_property
+
+import aggregates
+import cache
+import artifacts
+import bootstrap
+import cooccurrence
+import duplicates
+import embedding_cache
+import figures
+import hierarchy
+import projection
+import search
+import similarity
+import sentence_embeddings
+import store
+import topic_index
 
 OTHER_LABEL = 'Sonstiges'
 
@@ -51,32 +66,63 @@ custom_names = {
 color_sek1 = 'rgb(180, 120, 20)'
 color_sek2 = 'rgb(20, 120, 180)'
 
+# Threads that miss the model at the same time must not each unpickle it
+_topic_model_lock = threading.Lock()
+
 
 @dataclass
 class CurriculaAnalysis():
 
     def __init__(self):
-        self.documents = pd.read_json(os.path.join('data', 'documents.json'))
-        self.sentences = pd.read_json(os.path.join('data', 'sentences.json'))
+        self.documents, self.df, self.duality = store.load_store()
+
+        # Derived results and figures are stored for the version of the loaded data, not the one on disk when used
+        self.version = store.version()
+
+        self.sentences = self.df[['document', 'i', 'sentence', 'raw_sentence']]
 
         self.docs = self.sentences['sentence']
 
-        self.topic_model = BERTopic.load(os.path.join('model', 'topic_model_merged.pkl'))
+        self.model = artifacts.load_artifacts()
 
-        self.df = self.sentences.merge(self.documents, left_on='document', right_index=True, how='left')
+        self._topic_model = None
 
         #self.nlp = stanza.Pipeline(lang='de', processors='tokenize,mwt,pos,lemma')
 
-        self.duality = pd.read_json(os.path.join('data', 'duality.json'))
 
+    @property
+    def topic_model(self):
+        """
+        The full BERTopic model is only loaded the first time a view needs to embed text.
+        """
+        if self._topic_model is None:
+            with _topic_model_lock:
+                if self._topic_model is None:
+                    self._topic_model = artifacts.load_topic_model()
+
+        return self._topic_model
+
+    @cached_property
+    def embedding_cache(self):
+        return embedding_cache.EmbeddingCache(embedding_cache.cache_path(artifacts.model_fingerprint()))
+
+    def embed(self, texts):
+        """
+        Embeds texts with the embedding model of the topic model. Embeddings are cached on disk,
+        so the full model is only loaded for texts that have never been embedded before.
+        """
+        def compute(missing):
+            return self.topic_model._extract_embeddings(missing, method='word', verbose=False)
+
+        return self.embedding_cache.embed(texts, compute)
 
     @property
     def states(self):
-        return sorted(self.df['bundesland'].unique())
+        return list(self.df['bundesland'].cat.categories)
 
     @property
     def level(self):
-        return sorted(self.df['stufe'].unique())
+        return list(self.df['stufe'].cat.categories)
 
     @property
     def df_topics(self):
@@ -84,7 +130,7 @@ class CurriculaAnalysis():
         :return:
         DataFrame for downloading
         """
-        df_topics = self.topic_model.get_topic_info().set_index('Topic')[['CustomName', 'Count', 'Representation']]
+        df_topics = self.model.get_topic_info().set_index('Topic')[['CustomName', 'Count', 'Representation']]
 
         df_topics.index.name = None
 
@@ -105,38 +151,75 @@ class CurriculaAnalysis():
 
     @property
     def df_props(self):
-        probabilities = self.topic_model.probabilities_
-        labels = self.topic_model.get_topic_info()['CustomName'].tolist()[1:]
-        df_props = pd.DataFrame(probabilities, columns=labels)
-        df_props[OTHER_LABEL] = 1 - df_props.sum(axis=1)
+        return aggregates.topic_props(self.df, self.model)
 
-        df_props = pd.concat([self.df[['bundesland', 'stufe']], df_props], axis=1)
+    @cached_property
+    def cube(self):
+        """
+        :return:
+        Topic probabilities aggregated per curriculum, shared by all figures
+        """
+        return aggregates.load_cube(self.df_props, self.version)
+
+    @cached_property
+    def topic_index(self):
+        props = self.df_props.drop(['bundesland', 'stufe'], axis=1)
+        return topic_index.load_topic_index(props, self.version)
+
+    @cached_property
+    def bootstrap(self):
+        return bootstrap.load_bootstrap(
+            self.model.probabilities_, self.cube, self.curricula, self.version, processes=store.SESSION_PROCESSES
+        )
+
+    @cache.cached(maxsize=64, copy=False)
+    def share_replicates(self, level=None, states=None):
+        """
+        :param states:
+        tuple of states, all by default
+        :return:
+        Bootstrap replicates of the mean topic shares of the curricula of the level and states (replicates × topics)
+        """
+        return self.bootstrap.means(self.bootstrap.rows(level, states))
 
-        return df_props
+    def share_intervals(self, level=None, states=None):
+        """
+        :return:
+        DataFrame with the lower and upper bound of the confidence interval of the mean topic shares in percent
+        """
+        lower, upper = bootstrap.Bootstrap.interval(self.share_replicates(level, states)) * 100
+        return pd.DataFrame({'lower': lower, 'upper': upper}, index=self.bootstrap.topics)
 
-    @st.cache_resource
+    @cache.cached(maxsize=1)
+    @figures.stored()
     def get_total_topic_dist(self):
 
-        # Calculate mean for each curriculum
-        prop = self.df_props.groupby(['bundesland', 'stufe']).mean()
+        # Mean for each curriculum
+        prop = self.cube.mean
+
+        intervals = self.share_intervals().loc[prop.columns]
 
         fig = go.Figure(
             data=[
                 go.Pie(
                     labels=prop.columns,
                     values=prop.mean(),
-                    hole=0.3
+                    hole=0.3,
+                    customdata=intervals.to_numpy(),
+                    hovertemplate='%{label}<br>%{percent}<br>95%-KI: %{customdata[0]:.2f} – %{customdata[1]:.2f} %'
+                                  '<extra></extra>'
                 )
             ],
         )
 
         return fig
 
-    @st.cache_resource
+    @cache.cached(maxsize=1)
+    @figures.stored()
     def get_topic_dist_for_level(self):
 
-        # Calculate mean for each curriculum
-        prop = self.df_props.groupby(['bundesland', 'stufe']).mean()
+        # Mean for each curriculum
+        prop = self.cube.mean
 
         fig = make_subplots(
             rows=1,
@@ -185,26 +268,25 @@ class CurriculaAnalysis():
 
     @property
     def n_curricula(self):
-        return len(self.documents.groupby(['bundesland', 'stufe']))
+        return len(self.documents.groupby(['bundesland', 'stufe'], observed=True))
 
 
     @property
     def n_sentences(self):
         return len(self.sentences)
 
-    @st.cache_resource
+    @cache.cached(maxsize=1)
     def sentences_per_curriculum(self):
-        lengths = self.df.groupby(['bundesland', 'stufe']).apply(lambda g: len(g)).unstack(level=1)
+        lengths = self.df.groupby(['bundesland', 'stufe'], observed=True).apply(lambda g: len(g)).unstack(level=1)
 
-    @st.cache_resource
+    @cache.cached(maxsize=1)
+    @figures.stored()
     def plot_level(self):
-        df_props = self.df_props
-
-        df_props = df_props[df_props['bundesland'].isin(COMPLETE_STATES)]
+        df_curricula = self.cube.mean.reset_index()
 
-        df_curricula = df_props.groupby(['bundesland', 'stufe'], as_index=False).mean()
+        df_curricula = df_curricula[df_curricula['bundesland'].isin(COMPLETE_STATES)]
 
-        df_level = df_curricula.drop('bundesland', axis=1).groupby('stufe').mean().T
+        df_level = df_curricula.drop('bundesland', axis=1).groupby('stufe', observed=True).mean().T
 
         df_level = df_level*100
 
@@ -212,10 +294,31 @@ class CurriculaAnalysis():
 
         df_level = df_level.sort_values('diff')
 
+        # Bootstrap confidence intervals of the shares and of their difference
+        states = tuple(COMPLETE_STATES)
+        intervals = {
+            level: self.share_intervals(level, states).loc[df_level.index]
+            for level in ['Sekundarstufe I', 'Sekundarstufe II']
+        }
+
+        diff = self.share_replicates('Sekundarstufe I', states) - self.share_replicates('Sekundarstufe II', states)
+        lower, upper = bootstrap.Bootstrap.interval(diff) * 100
+        intervals['diff'] = pd.DataFrame({'lower': lower, 'upper': upper}, index=self.bootstrap.topics)
+        intervals['diff'] = intervals['diff'].loc[df_level.index]
+
+        def error_x(column):
+            return dict(
+                type='data',
+                symmetric=False,
+                array=intervals[column]['upper'] - df_level[column],
+                arrayminus=df_level[column] - intervals[column]['lower']
+            )
+
         diff_trace = go.Bar(
                     name='Differenz',
                     y=df_level.index,
                     x=df_level['diff'],
+                    error_x=error_x('diff'),
                     orientation='h'
                 )
 
@@ -225,12 +328,14 @@ class CurriculaAnalysis():
                     name='Sekundarstufe II',
                     y=df_level.index,
                     x=df_level['Sekundarstufe II'],
+                    error_x=error_x('Sekundarstufe II'),
                     orientation='h'
                 ),
                 go.Bar(
                     name='Sekundarstufe I',
                     y=df_level.index,
                     x=df_level['Sekundarstufe I'],
+                    error_x=error_x('Sekundarstufe I'),
                     orientation='h'
                 ),
                 diff_trace
@@ -274,18 +379,15 @@ class CurriculaAnalysis():
 
         return fig
 
-    @st.cache_resource
+    @cache.cached(maxsize=1)
+    @figures.stored()
     def plot_level_barpolar(self):
-        df_props = self.df_props
+        df_curricula = self.cube.mean.drop(OTHER_LABEL, axis=1).reset_index()
 
-        df_props = df_props[df_props['bundesland'].isin(COMPLETE_STATES)]
+        df_curricula = df_curricula[df_curricula['bundesland'].isin(COMPLETE_STATES)]
 
-        df_props = df_props.drop(OTHER_LABEL, axis=1)
 
-        df_curricula = df_props.groupby(['bundesland', 'stufe'], as_index=False).mean()
-
-
-        df_level = df_curricula.drop('bundesland', axis=1).groupby('stufe').mean().T
+        df_level = df_curricula.drop('bundesland', axis=1).groupby('stufe', observed=True).mean().T
 
 
         #df_level['diff'] = df_level['Sekundarstufe I'] - df_level['Sekundarstufe II']
@@ -327,11 +429,10 @@ class CurriculaAnalysis():
 
         return fig
 
-    @st.cache_resource
+    @cache.cached(maxsize=3)
+    @figures.stored()
     def plot_states(self, level=None):
-        df_props = self.df_props
-
-        df_props = (df_props.groupby(['bundesland', 'stufe']).mean() * 100).drop(OTHER_LABEL, axis=1)
+        df_props = (self.cube.mean * 100).drop(OTHER_LABEL, axis=1)
 
         if level in ['Sekundarstufe I', 'Sekundarstufe II']:
             #df = df_props[df_props['stufe'] == level].drop('bunde')
@@ -342,11 +443,18 @@ class CurriculaAnalysis():
 
             df = df[df['bundesland'].isin(COMPLETE_STATES)]
 
-            df = df.drop('stufe', axis=1).groupby('bundesland').mean()
+            df = df.drop('stufe', axis=1).groupby('bundesland', observed=True).mean()
 
 
             #df = df_props[df_props['bundesland'].isin(COMPLETE_STATES)].groupby('bundesland').mean()
 
+        # Bootstrap confidence interval of every cell, shown on hover
+        intervals = [
+            self.share_intervals(level if level != 'Sekundarstufe I & II' else None, (state,)).loc[df.columns]
+            for state in df.index
+        ]
+        customdata = np.stack([[i[bound].to_numpy() for i in intervals] for bound in ['lower', 'upper']], axis=-1)
+
         fig = go.Figure(
             go.Heatmap(
                 z=df,
@@ -355,6 +463,9 @@ class CurriculaAnalysis():
                 text=df.round(1),
                 texttemplate="%{text}",
                 textfont={"size": 12},
+                customdata=customdata,
+                hovertemplate='%{y}<br>%{x}<br>%{z:.1f} % (95%-KI: %{customdata[0]:.1f} – %{customdata[1]:.1f})'
+                              '<extra></extra>'
             )
         )
 
@@ -374,9 +485,58 @@ class CurriculaAnalysis():
 
         return fig
 
-    @st.cache_resource
+    @cache.cached(maxsize=3)
+    @figures.stored()
+    def plot_curriculum_similarity(self, metric='cosine'):
+        """
+        Clustered heatmap of the distances between all curricula, see similarity.METRICS
+        """
+        names = self.cube.curricula
+
+        def compute():
+            if metric == 'centroid':
+                ranges = [self.curricula.ranges[name] for name in names]
+                return similarity.centroid_distances(self.sentence_index.embeddings, ranges)
+
+            return similarity.topic_distances(self.cube, metric)
+
+        fig = similarity.plot_distances(similarity.load_distances(metric, self.version, compute), names)
+
+        fig.update_layout(
+            height=800,
+            xaxis=dict(
+                tickangle=60
+            )
+        )
+
+        return fig
+
+    @cached_property
+    def cooccurrence(self):
+        return cooccurrence.load_cooccurrence(self.df, self.model, self.version)
+
+    @cache.cached(maxsize=32)
+    @figures.stored()
+    def plot_cooccurrence(self, state=None, level=None):
+        """
+        Heatmap of the lift of the topic pairs within the sections of the curricula of the state and level (all by
+        default)
+        """
+        fig = cooccurrence.plot_lift(self.cooccurrence.lift(state, level), self.cooccurrence.matrix(state, level)[0])
+
+        fig.update_layout(
+            height=800,
+            xaxis=dict(
+                tickangle=60
+            )
+        )
+
+        return fig
+
+    @cache.cached(maxsize=1)
+    @figures.stored()
     def plot_topic_similarity(self):
-        fig = self.topic_model.visualize_hierarchy(custom_labels=True)
+        fig = hierarchy.plot_hierarchy(hierarchy.load_hierarchy())
 
         fig.update_layout(
             template="plotly_dark",
@@ -388,9 +548,18 @@ class CurriculaAnalysis():
 
         return fig
 
-    @st.cache_resource
+    @cache.cached(maxsize=1)
     def plot_sentences(self):
-        fig = self.topic_model.visualize_documents(self.docs, custom_labels=True, hide_annotations=True)
+        def compute():
+            return projection.compute_projection(self.sentence_index.embeddings)
+
+        xy = projection.load_projection(self.version, compute)
+
+        topic_info = self.model.get_topic_info()
+        names = dict(zip(topic_info['Topic'], topic_info['CustomName']))
+        names.pop(-1, None)
+
+        fig = projection.plot_projection(xy, self.model.topics_, names, self.df['raw_sentence'])
 
         fig.update_layout(
             template="plotly",
@@ -405,16 +574,21 @@ class CurriculaAnalysis():
 
         return fig
 
-    @st.cache_resource
-    def get_topic(self, topic_name, threshold=0.8):
+    def get_topic(self, topic_name, threshold=0.8, state=None, level=None):
+
+        df = self.df
 
-        df_topics = self.df_topics
+        filters = []
 
-        topic = df_topics[df_topics['Thema'] == topic_name].index[0]
+        if state is not None:
+            filters.append((df['bundesland'].array.codes, df['bundesland'].cat.categories.get_loc(state)))
 
-        df_props = self.df_props
+        if level is not None:
+            filters.append((df['stufe'].array.codes, df['stufe'].cat.categories.get_loc(level)))
 
-        docs = self.df[df_props[topic_name] > threshold]
+        ids = self.topic_index.query(topic_name, threshold, filters)
+
+        docs = df.iloc[ids]
 
         docs = docs[['raw_sentence', 'bundesland', 'stufe', 'titel']]
 
@@ -429,12 +603,12 @@ class CurriculaAnalysis():
 
         return docs
 
-    @st.cache_resource
+    @cache.cached(maxsize=256, ttl=3600)
     def search_term(self, search_term, threshold=0.5):
 
-        search_term = search_term.lower()
+        search_embedding = self.embed([search_term])[0]
 
-        topics, props = self.topic_model.find_topics(search_term=search_term)
+        topics, props = self.model.find_topics(search_embedding)
 
 
         s = pd.Series(props, index=topics)
@@ -451,22 +625,101 @@ class CurriculaAnalysis():
 
         return result
 
-    @st.cache_resource
+    @cached_property
+    def sentence_index(self):
+        def compute():
+            return sentence_embeddings.embed_sentences(
+                self.docs.tolist(), self.version, self.topic_model, processes=store.SESSION_PROCESSES
+            )
+
+        return search.load_sentence_index(self.version, compute)
+
+    def search_sentences(self, search_term, k=20, state=None, level=None):
+        """
+        :return:
+        The k sentences most similar to the search term, optionally restricted to a state and/or level
+        """
+        query = self.embed([search_term])[0]
+
+        ids, scores = self.sentence_index.search(query, k, ranges=self.curricula.select(state, level))
+
+        result = self.df.iloc[ids][['raw_sentence', 'bundesland', 'stufe', 'titel']]
+
+        result = result.rename({
+            'raw_sentence': 'Phrase',
+            'bundesland': 'Bundesland',
+            'stufe': 'Stufe',
+            'titel': 'Abschnitt'
+        }, axis=1)
+
+        result['Ähnlichkeit'] = scores
+
+        return result.reset_index(drop=True)
+
+    def cache_stats(self):
+        """
+        :return:
+        Statistics of the caches of this process, including the embedding cache
+        """
+        stats = cache.stats()
+
+        embeddings = self.embedding_cache.stats()
+        stats.loc[len(stats)] = {
+            'name': 'embedding_cache',
+            'entries': embeddings['size'],
+            'maxsize': embeddings['maxsize'],
+            'hits': embeddings['hits'],
+            'misses': embeddings['misses']
+        }
+
+        return stats
+
+    @cached_property
+    def curricula(self):
+        return store.load_curricula()
+
     def get_curriculum(self, state, level):
-        df = self.df.copy()
-        df = df[(df['bundesland'] == state) & (df['stufe'] == level)]
+        return self.df.iloc[self.curricula.rows(state, level)]
 
+    def get_curriculum_text(self, state, level):
+        """
+        :return:
+        List of (titel, markdown) of the sections of the curriculum
+        """
+        return self.curricula.text(state, level)
+
+    @cached_property
+    def duplicates(self):
+        return duplicates.load_duplicates(self.df, self.version, processes=store.SESSION_PROCESSES)
+
+    @cache.cached(maxsize=1)
+    def get_duplicate_clusters(self):
+        """
+        :return:
+        One row per cluster of near-duplicate phrases, see duplicates.summarize
+        """
+        return duplicates.summarize(self.duplicates)
+
+    def get_duplicate_cluster(self, cluster):
+        return self.duplicates[self.duplicates['cluster'] == cluster].drop('cluster', axis=1)
 
-        return df
+    @cache.cached(maxsize=1, copy=False)
+    def get_duplicates_csv(self):
+        """
+        :return:
+        The clusters as UTF-8 encoded CSV, for the download of the dashboard
+        """
+        return self.duplicates.to_csv(index=False).encode('utf-8')
 
-    @st.cache_resource
+    @cache.cached(maxsize=1)
+    @figures.stored()
     def plot_duality(self):
         duality = self.duality
-        duality = duality.groupby(self.topic_model.topics_).mean()
+        duality = duality.groupby(self.model.topics_).mean()
 
         duality = duality.drop(-1)
 
-        topics = self.topic_model.get_topic_info().set_index('Topic')
+        topics = self.model.get_topic_info().set_index('Topic')
 
         duality.index = map(lambda topic: topics.loc[topic]['CustomName'], duality.index)
 